@@ -0,0 +1,128 @@
+# backends.py
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+
+# --- ОПИС БЕКЕНДА ---
+class Backend:
+    """
+    Один сервіс завантаження і все, що про нього треба знати ззовні.
+
+    download(url, session_dir, audio_only, max_height, progress_callback,
+    http_session) повертає List[MediaFile] або None.
+
+    hosts — домени (піддомени підхоплюються автоматично), audio_hosts — ті
+    з них, де посилання завжди означає аудіо (music.youtube.com).
+    Можливості: audio — є режим "тільки аудіо", quality — можна обрати
+    висоту і оцінити розмір до завантаження (yt-dlp). concurrency — ліміт
+    одночасних job за замовчуванням (BACKEND_LIMITS його перевизначає).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        label: str,
+        hosts: Iterable[str],
+        download: Callable[..., Awaitable],
+        audio: bool = False,
+        quality: bool = False,
+        concurrency: int = 2,
+        audio_hosts: Iterable[str] = (),
+        direct_paths: Iterable[str] = (),
+        host_aliases: Optional[Dict[str, str]] = None,
+        canonicalize: Optional[Callable[[str, str, list], Optional[str]]] = None,
+        keep_query: bool = True,
+        start_text: Optional[str] = None,
+    ):
+        self.name = name
+        self.label = label
+        self.hosts = [h.lower() for h in hosts]
+        self.download = download
+        self.audio = audio
+        self.quality = quality
+        self.concurrency = concurrency
+        self.audio_hosts = {h.lower() for h in audio_hosts}
+        # Шляхи, для яких вибір якості не пропонуємо (короткі ролики)
+        self.direct_paths = tuple(direct_paths)
+        self.host_aliases = host_aliases or {}
+        self.canonicalize = canonicalize
+        self.keep_query = keep_query
+        self.start_text = start_text
+
+    def is_audio_url(self, url: str) -> bool:
+        # Як і маршрутизація: m.soundcloud.com — теж soundcloud.com
+        return self.audio and any(
+            host in self.audio_hosts for host in _parent_domains(_hostname(url))
+        )
+
+    def offers_quality(self, url: str) -> bool:
+        """Чи показувати для посилання клавіатуру вибору якості."""
+        if not self.quality:
+            return False
+        path = urlsplit(url.strip()).path.lower()
+        return not path.startswith(self.direct_paths)
+
+    def __repr__(self) -> str:
+        return f"Backend({self.name!r}, hosts={self.hosts!r})"
+
+
+def _hostname(url: str) -> str:
+    host = (urlsplit(url.strip()).hostname or "").lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix) :]
+    return host
+
+
+def _parent_domains(host: str):
+    """Хост і його батьківські домени: m.youtube.com, youtube.com, com."""
+    host = host.lower().rstrip(".")
+    while host:
+        yield host
+        _, _, host = host.partition(".")
+
+
+# --- РЕЄСТР І МАРШРУТИЗАЦІЯ ---
+class BackendRegistry:
+    """
+    Реєстр бекендів з таблицею "домен -> бекенд".
+
+    Маршрутизація — кілька звернень до dict: хост і його батьківські домени
+    (m.youtube.com -> youtube.com -> com), без перебору підрядків.
+    """
+
+    def __init__(self):
+        self._backends: Dict[str, Backend] = {}
+        self._routes: Dict[str, Backend] = {}
+
+    def register(self, backend: Backend) -> Backend:
+        if backend.name in self._backends:
+            raise ValueError(f"Backend {backend.name!r} already registered")
+        for host in backend.hosts:
+            owner = self._routes.get(host)
+            if owner is not None:
+                raise ValueError(f"Host {host!r} already routed to {owner.name!r}")
+        self._backends[backend.name] = backend
+        for host in backend.hosts:
+            self._routes[host] = backend
+        return backend
+
+    def get(self, name: str) -> Optional[Backend]:
+        return self._backends.get(name)
+
+    def match_host(self, host: str) -> Optional[Backend]:
+        for domain in _parent_domains(host):
+            backend = self._routes.get(domain)
+            if backend is not None:
+                return backend
+        return None
+
+    def resolve(self, url: str) -> Optional[Backend]:
+        """Бекенд для посилання або None, якщо сервіс не підтримується."""
+        return self.match_host(_hostname(url))
+
+    def all(self) -> List[Backend]:
+        return list(self._backends.values())
+
+    def default_limits(self) -> Dict[str, int]:
+        return {b.name: b.concurrency for b in self._backends.values()}
@@ -0,0 +1,96 @@
+# benchmarks/audio_modes.py
+"""
+Порівняння AUDIO_MODE=native і AUDIO_MODE=mp3 на одному посиланні.
+
+Запуск з кореня репозиторію:
+    python benchmarks/audio_modes.py "https://www.youtube.com/watch?v=..." [повторів]
+
+Кожен прогін іде в окремому процесі, тож CPU дочірніх процесів
+(ffmpeg, пул обробки) рахується чесно для кожного режиму.
+"""
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = """
+import asyncio, json, os, resource, sys, time
+sys.path.insert(0, {root!r})
+from downloader_lib import _download_youtube_async, shutdown_ytdlp_pool
+from postprocess import shutdown_postprocess_pool
+
+async def main():
+    started = time.perf_counter()
+    files = await _download_youtube_async({url!r}, {session_dir!r}, True, None, None)
+    return files, time.perf_counter() - started
+
+files, wall = asyncio.run(main())
+shutdown_postprocess_pool()
+shutdown_ytdlp_pool()
+own = resource.getrusage(resource.RUSAGE_SELF)
+print(json.dumps({{
+    "wall": wall,
+    "cpu_self": own.ru_utime + own.ru_stime,
+    "files": [(f.name, f.size) for f in files or []],
+}}))
+"""
+
+
+def run_once(url: str, mode: str) -> dict:
+    session_dir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    env = dict(os.environ, AUDIO_MODE=mode)
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                _CHILD.format(root=ROOT, url=url, session_dir=session_dir),
+            ],
+            env=env,
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    finally:
+        shutil.rmtree(session_dir, ignore_errors=True)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = json.loads(out.strip().splitlines()[-1])
+    # Дочірні процеси бенчмарка = інтерпретатор + ffmpeg + пул обробки
+    result["cpu_total"] = (after.ru_utime + after.ru_stime) - (
+        before.ru_utime + before.ru_stime
+    )
+    return result
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    url = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    for mode in ("native", "mp3"):
+        runs = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            runs.append(run_once(url, mode))
+            runs[-1]["process_wall"] = time.perf_counter() - started
+        wall = sorted(r["wall"] for r in runs)[len(runs) // 2]
+        cpu = sorted(r["cpu_total"] for r in runs)[len(runs) // 2]
+        name, size = runs[-1]["files"][0] if runs[-1]["files"] else ("-", 0)
+        print(
+            f"{mode:>6}: wall {wall:.2f}s, cpu {cpu:.2f}s (медіана з {repeats}), "
+            f"{name} {size / 1024 / 1024:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
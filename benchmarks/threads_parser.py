@@ -0,0 +1,165 @@
+# benchmarks/threads_parser.py
+"""
+Порівняння старого парсера Threads (regex по всіх data-sjs + рекурсивний
+_find_node_with_code) з threads_parser.find_post_node: час і пік пам'яті.
+
+Запуск з кореня репозиторію:
+    python benchmarks/threads_parser.py                  # синтетична сторінка
+    python benchmarks/threads_parser.py page.html ...    # збережені сторінки
+    python benchmarks/threads_parser.py downloads/_failures/threads/
+
+Приймає .html, .html.gz і теки з ними. Shortcode береться з "/post/<code>"
+в URL з метаданих знімка (FailureStore) або в самій сторінці.
+"""
+import gzip
+import json
+import os
+import random
+import re
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from threads_parser import find_post_node  # noqa: E402
+
+_SCRIPT_RE = re.compile(r"<script[^>]*data-sjs[^>]*>(.*?)</script>", re.DOTALL)
+_POST_RE = re.compile(r"/post/([A-Za-z0-9_-]+)")
+
+
+# --- СТАРИЙ ПАРСЕР (як було в downloader_lib) ---
+def _legacy_find(data, code):
+    if isinstance(data, dict):
+        if data.get("code") == code:
+            return data
+        for v in data.values():
+            res = _legacy_find(v, code)
+            if res:
+                return res
+    elif isinstance(data, list):
+        for item in data:
+            res = _legacy_find(item, code)
+            if res:
+                return res
+    return None
+
+
+def legacy_find_post_node(html, shortcode):
+    for json_text in _SCRIPT_RE.findall(html):
+        try:
+            found = _legacy_find(json.loads(json_text), shortcode)
+            if found:
+                return found
+        except Exception:
+            pass
+    return None
+
+
+# --- ФІКСТУРИ ---
+def _noise(rng, depth, width):
+    if depth == 0:
+        return "".join(rng.choices(string.ascii_letters, k=24))
+    return {
+        f"k{i}": [_noise(rng, depth - 1, width) for _ in range(2)]
+        for i in range(width)
+    }
+
+
+def synthetic_page(scripts=40, depth=4, width=3, nested=0, seed=1):
+    """Сторінка, схожа на Threads: багато data-sjs, пост — в останньому скрипті."""
+    rng = random.Random(seed)
+    code = "C" + "".join(rng.choices(string.ascii_letters, k=10))
+    post = json.dumps(
+        {
+            "code": code,
+            "image_versions2": {
+                "candidates": [{"url": "https://cdn/x.jpg", "width": 1080}]
+            },
+        }
+    )
+    # Рядком, бо json.dumps сам упирається в ліміт рекурсії
+    post = '{"wrapper": [' * nested + post + "]}" * nested
+    parts = [
+        "<html><head><meta property='og:url' "
+        "content='https://www.threads.net/@u/post/%s'>" % code
+    ]
+    for i in range(scripts):
+        payload = json.dumps({"require": [_noise(rng, depth, width)]})
+        if i == scripts - 1:
+            payload = payload[:-2] + ", " + post + "]}"
+        parts.append('<script type="application/json" data-sjs>%s</script>' % payload)
+    parts.append("</head></html>")
+    return "".join(parts), code
+
+
+def load_fixtures(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            yield from load_fixtures(
+                os.path.join(path, n) for n in names if n.endswith((".html", ".html.gz"))
+            )
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            html = f.read()
+        # Знімки з FailureStore мають поруч .json з URL запиту
+        meta_path = path.split(".html", 1)[0] + ".json"
+        source = html
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                source = json.load(f).get("url") or html
+        match = _POST_RE.search(source)
+        if match:
+            yield os.path.basename(path), html, match.group(1)
+
+
+# --- ЗАМІРИ ---
+def measure(func, html, code, repeats=5):
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        try:
+            result = func(html, code)
+        except RecursionError:
+            return None, None, "RecursionError"
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func(html, code)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, "found" if result else "miss"
+
+
+def report(name, html, code):
+    print(f"{name}: {len(html) / 1024:.0f} KB")
+    for label, func in (("legacy", legacy_find_post_node), ("indexed", find_post_node)):
+        best, peak, status = measure(func, html, code)
+        if best is None:
+            print(f"  {label:>8}: {status}")
+        else:
+            print(
+                f"  {label:>8}: {best * 1000:8.2f} ms, пік {peak / 1024 / 1024:6.1f} MB, {status}"
+            )
+
+
+def main():
+    if len(sys.argv) > 1:
+        fixtures = list(load_fixtures(sys.argv[1:]))
+        if not fixtures:
+            print("Жодної сторінки з /post/<code> не знайдено.")
+            sys.exit(1)
+        for name, html, code in fixtures:
+            report(name, html, code)
+        return
+
+    report("synthetic (40 scripts)", *synthetic_page())
+    # 450 рівнів (dict + list на кожному) ще в межах ліміту рекурсії: глибше
+    # вже json.loads падає для обох парсерів, тож порівнювати там нічого
+    report("synthetic (450 levels)", *synthetic_page(scripts=5, nested=450))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import copy
 import glob
 import os
 import sys
@@ -10,6 +11,8 @@ from mutagen.id3 import APIC, ID3, TDRC, error
 from mutagen.mp3 import MP3
 from PIL import Image
 
+from info_cache import InfoCache, extract_info_cached
+
 # Ініціалізація colorama
 init(autoreset=True)
 
@@ -20,6 +23,9 @@ ERROR = Fore.RED + Style.BRIGHT
 PROMPT = Fore.YELLOW + Style.BRIGHT
 HEADER = Fore.MAGENTA + Style.BRIGHT
 
+# Список форматів і завантаження того ж посилання не парсять сторінку двічі
+info_cache = InfoCache(max_entries=8)
+
 
 def clear_screen():
     """Очищує екран консолі."""
@@ -115,11 +121,9 @@ def _fix_date_metadata(mp3_path: str):
 def get_available_formats(url: str):
     """Отримує та виводить відфільтрований список форматів."""
     print(INFO + "\n🔎 Fetching available formats, please wait...")
-    ydl_opts = {"quiet": True}
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+        info = extract_info_cached(info_cache, url)
 
         print(SUCCESS + "✅ Formats found! Here are the best options:\n")
         print(
@@ -224,7 +228,11 @@ def download_ytmusic_with_metadata(url: str) -> Optional[str]:
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             print(INFO + "\n📥 Downloading audio with metadata...")
-            info = ydl.extract_info(url, download=True)
+            info = info_cache.get(url)
+            if info:
+                info = ydl.process_ie_result(copy.deepcopy(info), download=True)
+            else:
+                info = ydl.extract_info(url, download=True)
 
             base_path = ydl.prepare_filename(info)
             mp3_path = os.path.splitext(base_path)[0] + ".mp3"
@@ -290,14 +298,19 @@ def download_media(url: str, audio_only: bool = False, format_id: str = None):
 
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+            info = info_cache.get(url)
+            if info:
+                # Формати вже отримані (пункт 3 меню) — без повторного extract_info
+                ydl.process_ie_result(copy.deepcopy(info), download=True)
+            else:
+                ydl.download([url])
     except Exception as e:
         print(ERROR + f"\n❌ An error occurred during download: {e}")
 
 
 def handle_download_session():
     """Керує сесією завантаження для одного посилання."""
-    url = input(PROMPT + "\n🔗 Enter the media URL: ")
+    url = input(PROMPT + "\n🔗 Enter the media URL: ").strip()
     if not url.strip().startswith("http"):
         print(ERROR + "Invalid URL. Please try again.")
         return
@@ -1,32 +1,280 @@
 # downloader_lib.py
 import asyncio
-import glob
+import copy
+import functools
 import json
 import os
 import re
 import shutil
+import threading
 import time
-from io import BytesIO
-from pathlib import Path
-from typing import Callable, List, Optional
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import aiohttp
 import instaloader
 import yt_dlp
-from mutagen.id3 import APIC, ID3, TDRC, TIT2, TPE1, error
-from mutagen.mp3 import MP3
-from PIL import Image
+
+from backends import Backend, BackendRegistry
+from failure_store import FailureStore
+from http_fetch import FileTooLarge, fetch_many, fetch_with_retries, session_scope
+from info_cache import InfoCache, extract_info, extract_info_cached
+from instagram_pool import InstaloaderPool, is_missing_content
+from media_cache import MediaCache, link_or_copy
+from media_file import KIND_AUDIO, KIND_PHOTO, KIND_VIDEO, MediaFile
+from postprocess import get_postprocess_pool, process_audio, record_timings
+from resilience import (
+    BackendError,
+    CircuitOpenError,
+    ContentUnavailable,
+    Resilience,
+    TransientError,
+)
+from threads_parser import extract_media_urls, find_post_node
+from ytdlp_pool import YtdlpProcessPool
+
+DOWNLOADS_DIR = "downloads"
+
+# Бекенди реєструються нижче, після своїх функцій завантаження
+registry = BackendRegistry()
+
+_media_cache: Optional[MediaCache] = None
+
+
+def get_media_cache() -> MediaCache:
+    # Створюємо ліниво, щоб .env вже був завантажений ботом
+    global _media_cache
+    if _media_cache is None:
+        _media_cache = MediaCache(
+            root=os.getenv("MEDIA_CACHE_DIR", os.path.join(DOWNLOADS_DIR, "_cache")),
+            max_bytes=int(os.getenv("MEDIA_CACHE_MAX_MB", "4096")) * 1024 * 1024,
+            ttl=float(os.getenv("MEDIA_CACHE_TTL", str(24 * 3600))),
+        )
+    return _media_cache
+
+
+_failure_store: Optional[FailureStore] = None
+_capture_tasks: set = set()
+
+
+def get_failure_store() -> FailureStore:
+    global _failure_store
+    if _failure_store is None:
+        _failure_store = FailureStore(
+            root=os.getenv(
+                "FAILURE_CAPTURE_DIR", os.path.join(DOWNLOADS_DIR, "_failures")
+            ),
+            max_bytes=int(os.getenv("FAILURE_CAPTURE_MAX_MB", "50")) * 1024 * 1024,
+            max_files=int(os.getenv("FAILURE_CAPTURE_MAX_FILES", "200")),
+        )
+    return _failure_store
+
+
+def _log_capture_error(future: asyncio.Future):
+    _capture_tasks.discard(future)
+    if not future.cancelled() and future.exception():
+        print(f"Failure capture error: {future.exception()}")
+
+
+def capture_failure(
+    backend: str, url: str, payload, ext: str = "html", reason: str = ""
+):
+    """Зберігає знімок відповіді у фоні: стиснення і запис не блокують event loop."""
+    store = get_failure_store()
+    if not store.enabled:
+        return
+    loop = asyncio.get_event_loop()
+    future = loop.run_in_executor(None, store.capture, backend, url, payload, ext, reason)
+    # Тримаємо посилання, поки запис не завершиться
+    _capture_tasks.add(future)
+    future.add_done_callback(_log_capture_error)
+
+
+_resilience: Optional[Resilience] = None
+
+
+def get_resilience() -> Resilience:
+    global _resilience
+    if _resilience is None:
+        _resilience = Resilience(
+            retries=int(os.getenv("BACKEND_RETRIES", "2")),
+            base_delay=float(os.getenv("BACKEND_RETRY_DELAY", "1")),
+            max_delay=float(os.getenv("BACKEND_RETRY_MAX_DELAY", "10")),
+            window=int(os.getenv("BREAKER_WINDOW", "20")),
+            min_calls=int(os.getenv("BREAKER_MIN_CALLS", "5")),
+            failure_rate=float(os.getenv("BREAKER_FAILURE_RATE", "0.5")),
+            cooldown=float(os.getenv("BREAKER_COOLDOWN", "60")),
+            # Завеликий файл — властивість посилання, а не збій бекенда
+            neutral=(FileTooLarge,),
+        )
+    return _resilience
+
+
+def _is_transient_status(status: int) -> bool:
+    return status >= 500 or status == 429
+
+
+_ytdlp_executor: Optional[ThreadPoolExecutor] = None
+
+
+def new_session_dir() -> str:
+    return os.path.join(DOWNLOADS_DIR, str(time.time_ns()))
+
+
+def reap_session_dirs(keep: set) -> int:
+    """Видаляє сесійні папки, які не належать жодному незавершеному job."""
+    if not os.path.isdir(DOWNLOADS_DIR):
+        return 0
+    keep = {os.path.normpath(p) for p in keep}
+    removed = 0
+    for name in os.listdir(DOWNLOADS_DIR):
+        path = os.path.join(DOWNLOADS_DIR, name)
+        # Сесійні папки названі time_ns(); кеш та інше не чіпаємо
+        if not name.isdigit() or not os.path.isdir(path):
+            continue
+        if os.path.normpath(path) in keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def get_ytdlp_executor() -> ThreadPoolExecutor:
+    # Окремий пул для yt-dlp, щоб він не забивав дефолтний executor
+    global _ytdlp_executor
+    if _ytdlp_executor is None:
+        _ytdlp_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("YTDLP_WORKERS", "2")),
+            thread_name_prefix="yt-dlp",
+        )
+    return _ytdlp_executor
+
+
+_ytdlp_pool: Optional[YtdlpProcessPool] = None
+
+
+def _ytdlp_isolation() -> str:
+    # process — окремі процеси (за замовчуванням), thread — старий пул потоків
+    return os.getenv("YTDLP_ISOLATION", "process").lower()
+
+
+def get_ytdlp_pool() -> YtdlpProcessPool:
+    global _ytdlp_pool
+    if _ytdlp_pool is None:
+        _ytdlp_pool = YtdlpProcessPool(
+            size=int(os.getenv("YTDLP_WORKERS", "2")),
+            max_jobs=int(os.getenv("YTDLP_MAX_JOBS_PER_WORKER", "20")),
+            timeout=float(os.getenv("YTDLP_JOB_TIMEOUT", "3600")),
+        )
+    return _ytdlp_pool
+
+
+def shutdown_ytdlp_pool():
+    global _ytdlp_pool
+    if _ytdlp_pool is not None:
+        _ytdlp_pool.shutdown()
+        _ytdlp_pool = None
+
+
+# --- КАНОНІЗАЦІЯ URL ---
+_YT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+_YT_PATH_RE = re.compile(r"^/(?:shorts|live|embed|v)/([A-Za-z0-9_-]{11})")
+_TRACKING_PARAMS = {
+    "si",
+    "feature",
+    "pp",
+    "igsh",
+    "igshid",
+    "fbclid",
+    "gclid",
+    "is_from_webapp",
+    "sender_device",
+    "_r",
+    "_t",
+}
+
+
+def _canonical_youtube(host: str, path: str, query: list) -> Optional[str]:
+    # youtu.be / shorts / music / m. -> watch?v=ID
+    video_id = None
+    if host == "youtu.be":
+        video_id = path.lstrip("/").split("/")[0]
+    else:
+        match = _YT_PATH_RE.match(path)
+        if match:
+            video_id = match.group(1)
+        else:
+            video_id = dict(query).get("v")
+    if video_id and _YT_ID_RE.match(video_id):
+        return f"https://www.youtube.com/watch?v={video_id}"
+    return None
+
+
+def canonicalize_url(url: str) -> str:
+    """Приводить посилання до єдиного вигляду для ключів кешу."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix) :]
+    path = parts.path.rstrip("/") or "/"
+    query = parse_qsl(parts.query, keep_blank_values=False)
+
+    backend = registry.match_host(host)
+    if backend is not None:
+        host = backend.host_aliases.get(host, host)
+        if backend.canonicalize:
+            canonical = backend.canonicalize(host, path, query)
+            if canonical:
+                return canonical
+        if not backend.keep_query:
+            # Для цих сервісів query ніколи не впливає на контент
+            query = []
+    query = sorted(
+        (k, v)
+        for k, v in query
+        if k not in _TRACKING_PARAMS and not k.startswith("utm_")
+    )
+
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+def resolve_backend(url: str) -> Optional[Backend]:
+    """Бекенд, що обробить посилання (None — сервіс не підтримується)."""
+    return registry.resolve(url)
+
+
+def detect_backend(url: str) -> Optional[str]:
+    backend = registry.resolve(url)
+    return backend.name if backend else None
 
 
 # --- КЛАС ДЛЯ ПРОГРЕС-БАРУ (Тільки для yt-dlp) ---
 class ProgressHook:
-    def __init__(self, callback: Callable, loop: asyncio.AbstractEventLoop):
-        self.callback = callback
-        self.loop = loop
+    """
+    notify(text) — синхронна функція: у потоці це run_coroutine_threadsafe,
+    у процесі-воркері — відправка тексту через пайп.
+    """
+
+    def __init__(
+        self,
+        notify: Callable[[str], None],
+        cancel: Optional[threading.Event] = None,
+    ):
+        self.notify = notify
+        self.cancel = cancel
         self.last_update = 0
         self.update_interval = 3
 
+    def check_cancel(self, d=None):
+        # Потік не можна вбити — тому обриваємо yt-dlp з його ж хука
+        if self.cancel is not None and self.cancel.is_set():
+            raise yt_dlp.utils.DownloadCancelled()
+
     def __call__(self, d):
+        self.check_cancel()
         if d["status"] == "downloading":
             now = time.time()
             if now - self.last_update > self.update_interval or d.get(
@@ -50,88 +298,89 @@ class ProgressHook:
                         f"💾 `{curr_mb:.1f}MB / {total_mb:.1f}MB`\n"
                         f"🚀 `{speed_mb:.1f} MB/s`"
                     )
-                    asyncio.run_coroutine_threadsafe(self.callback(text), self.loop)
+                    self.notify(text)
         elif d["status"] == "finished":
-            asyncio.run_coroutine_threadsafe(
-                self.callback("⚙️ *Обробка медіа...*"), self.loop
-            )
+            self.notify("⚙️ *Обробка медіа...*")
 
 
-# --- ОБРОБКА МЕТАДАНИХ ---
-def _crop_and_embed_artwork(mp3_path: str, thumbnail_path: str):
-    try:
-        with Image.open(thumbnail_path) as img:
-            width, height = img.size
-            crop_size = min(width, height)
-            left, top, right, bottom = (
-                (width - crop_size) / 2,
-                (height - crop_size) / 2,
-                (width + crop_size) / 2,
-                (height + crop_size) / 2,
-            )
-            cropped_img = img.crop((left, top, right, bottom))
-            if cropped_img.mode in ("RGBA", "LA", "P"):
-                cropped_img = cropped_img.convert("RGB")
-            img_buffer = BytesIO()
-            cropped_img.save(img_buffer, format="JPEG", quality=95)
-            try:
-                audio = MP3(mp3_path, ID3=ID3)
-            except error:
-                audio = MP3(mp3_path)
-                audio.add_tags()
-            audio.tags.delall("APIC")
-            audio.tags.add(
-                APIC(
-                    encoding=3,
-                    mime="image/jpeg",
-                    type=3,
-                    desc="Cover",
-                    data=img_buffer.getvalue(),
-                )
-            )
+# --- YT-DLP (ДЛЯ ВСЬОГО, КРІМ INSTAGRAM) ---
+def _audio_mode() -> str:
+    # native — m4a/opus без перекодування, mp3 — старий шлях через ffmpeg
+    return os.getenv("AUDIO_MODE", "native").lower()
 
-            # Базові теги
-            if not audio.tags.get("TIT2"):
-                audio.tags.add(
-                    TIT2(encoding=3, text=os.path.basename(mp3_path).split(".")[0])
-                )
-            if not audio.tags.get("TPE1"):
-                audio.tags.add(TPE1(encoding=3, text="Unknown Artist"))
 
-            audio.save()
-            print(f"✓ Embedded artwork: {mp3_path}")
-    except Exception as e:
-        print(f"Error: {e}")
-    finally:
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
+def audio_variant(audio_only: bool) -> str:
+    """Частина ключів кешів: аудіо в режимах native і mp3 — різні файли."""
+    return _audio_mode() if audio_only else ""
 
 
-def _fix_metadata(mp3_path: str, title: str = None, uploader: str = None):
-    try:
-        audio = MP3(mp3_path, ID3=ID3)
-        if uploader and not audio.tags.get("TPE1"):
-            audio.tags.add(TPE1(encoding=3, text=uploader))
-        if title and not audio.tags.get("TIT2"):
-            audio.tags.add(TIT2(encoding=3, text=title))
-        if audio.tags and "TDRC" in audio.tags:
-            date_str = str(audio.tags["TDRC"].text[0])
-            if len(date_str) >= 4:
-                audio.tags["TDRC"] = TDRC(encoding=3, text=date_str[:4])
-        audio.save()
-    except Exception as e:
-        print(f"Error: {e}")
+def _format_spec(audio_only: bool, max_height: Optional[int]) -> str:
+    if audio_only:
+        if _audio_mode() == "mp3":
+            return "bestaudio/best"
+        return "bestaudio[ext=m4a]/bestaudio/best"
+    # Логіка якості відео
+    if max_height:
+        return f"bestvideo[height<={max_height}]+bestaudio/best[height<={max_height}]/best"
+    return "bestvideo+bestaudio/best"
+
+
+# Очікувані помилки yt-dlp, які не означають блокування. Фрази вузькі:
+# "Requested format is not available" і 404 протухлого посилання — не про відео
+_YTDLP_BLOCKED_MARKERS = ("not a bot", "429", "too many requests", "rate-limit")
+_YTDLP_UNAVAILABLE_MARKERS = (
+    "video unavailable",
+    "private video",
+    "this video is private",
+    "has been removed",
+    "this video is not available",
+    "members-only",
+    "confirm your age",
+    "unsupported url",
+)
+
+
+def _is_unavailable_error(e: Exception) -> bool:
+    """Відео недоступне саме по собі (а не yt-dlp заблокували)."""
+    text = str(e).lower()
+    if any(marker in text for marker in _YTDLP_BLOCKED_MARKERS):
+        return False
+    # ExtractorError(expected=True) — yt-dlp сам вважає помилку не своєю
+    cause = (getattr(e, "exc_info", None) or (None, None))[1]
+    if getattr(cause, "expected", False):
+        return True
+    return any(marker in text for marker in _YTDLP_UNAVAILABLE_MARKERS)
+
+
+# Так CDN відповідає на підписане посилання формату, що вже протухло
+_EXPIRED_URL_STATUSES = (403, 404, 410)
+
+
+def _is_expired_url_error(e: Exception) -> bool:
+    """Скачування формату з закешованого info впало на протухлому посиланні."""
+    cause = (getattr(e, "exc_info", None) or (None, None))[1]
+    status = getattr(cause, "status", None) or getattr(cause, "code", None)
+    if status in _EXPIRED_URL_STATUSES:
+        return True
+    text = str(e).lower()
+    return any(f"http error {status}" in text for status in _EXPIRED_URL_STATUSES)
 
 
-# --- YT-DLP (ДЛЯ ВСЬОГО, КРІМ INSTAGRAM) ---
 def _download_generic_sync(
     url: str,
     session_dir: str,
     audio_only: bool,
     max_height: Optional[int] = None,
-    progress_callback: Optional[Callable] = None,
-    loop: Optional[asyncio.AbstractEventLoop] = None,
-) -> Optional[List[str]]:
+    info: Optional[dict] = None,
+    notify: Optional[Callable[[str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Tuple[Optional[List[MediaFile]], Optional[dict], bool]:
+    """
+    Повертає (файли, аргументи для postprocess.process_audio або None,
+    чи протух переданий info). Обробка тегів і обкладинки робиться вже поза
+    цим процесом/потоком.
+    info — заздалегідь витягнутий info-dict (prefetch_info), щоб не парсити сторінку вдруге.
+    """
     ydl_opts = {
         "outtmpl": os.path.join(session_dir, "%(title)s.%(ext)s"),
         "quiet": True,
@@ -141,13 +390,16 @@ def _download_generic_sync(
         "allow_playlist": False,
     }
 
-    if progress_callback and loop:
-        ydl_opts["progress_hooks"] = [ProgressHook(progress_callback, loop)]
+    if notify:
+        hook = ProgressHook(notify, cancel)
+        ydl_opts["progress_hooks"] = [hook]
+        # Перед кожним постпроцесором (ffmpeg) теж перевіряємо скасування
+        ydl_opts["postprocessor_hooks"] = [hook.check_cancel]
 
-    if audio_only:
+    if audio_only and _audio_mode() == "mp3":
         ydl_opts.update(
             {
-                "format": "bestaudio/best",
+                "format": _format_spec(audio_only, max_height),
                 "postprocessors": [
                     {
                         "key": "FFmpegExtractAudio",
@@ -158,83 +410,386 @@ def _download_generic_sync(
                 ],
             }
         )
+    elif audio_only:
+        # Нативний потік: тільки ремукс (m4a/opus), без перекодування
+        ydl_opts.update(
+            {
+                "format": _format_spec(audio_only, max_height),
+                "postprocessors": [
+                    {"key": "FFmpegExtractAudio", "preferredcodec": "best"},
+                    {"key": "FFmpegMetadata", "add_metadata": True},
+                ],
+            }
+        )
     else:
-        # Логіка якості відео
-        if max_height:
-            format_str = f"bestvideo[height<={max_height}]+bestaudio/best[height<={max_height}]/best"
-        else:
-            format_str = "bestvideo+bestaudio/best"
-
         ydl_opts.update(
             {
-                "format": format_str,
+                "format": _format_spec(audio_only, max_height),
                 "merge_output_format": "mp4",
                 "postprocessors": [{"key": "FFmpegMetadata", "add_metadata": True}],
             }
         )
 
+    info_stale = False
+    # Помилки не ковтаємо: _download_media_once збереже traceback і врахує збій
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-
-            if audio_only:
-                base_path = ydl.prepare_filename(info)
-                mp3_path = os.path.splitext(base_path)[0] + ".mp3"
-                if not os.path.exists(mp3_path):
-                    found = glob.glob(os.path.join(session_dir, "*.mp3"))
-                    if found:
-                        mp3_path = found[0]
-
-                if os.path.exists(mp3_path):
-                    # Пошук обкладинки
-                    thumbnail_path = None
-                    for f in glob.glob(os.path.join(session_dir, "*")):
-                        if f.endswith((".jpg", ".webp", ".png")) and f != mp3_path:
-                            thumbnail_path = f
-                            break
-                    if thumbnail_path:
-                        _crop_and_embed_artwork(mp3_path, thumbnail_path)
-                    _fix_metadata(
-                        mp3_path, title=info.get("title"), uploader=info.get("uploader")
-                    )
-                    return [mp3_path]
-
-            allowed = [".mp4", ".mkv", ".mov", ".webm", ".mp3"]
-            return [
-                os.path.join(session_dir, f)
-                for f in os.listdir(session_dir)
-                if os.path.splitext(f)[1].lower() in allowed
+            if info:
+                # Метадані вже витягнуті заздалегідь — лише вибір формату і скачування
+                try:
+                    info = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                except yt_dlp.utils.DownloadError as e:
+                    # Посилання могли протухнути раніше, ніж обіцяв expire; збої
+                    # ffmpeg і постпроцесорів повторний витяг не виправить
+                    if not _is_expired_url_error(e):
+                        raise
+                    print(f"Cached info failed, extracting again: {e}")
+                    # Кеш живе в батьківському процесі — там його й чистять
+                    info_stale = True
+                    info = None
+            if not info:
+                info = ydl.extract_info(url, download=True)
+            # filepath у requested_downloads вже після постпроцесорів (ремукс/mp3)
+            downloads = info.get("requested_downloads") or [
+                {"filepath": ydl.prepare_filename(info)}
             ]
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
+    except yt_dlp.utils.DownloadError as e:
+        if _is_unavailable_error(e):
+            # Приватне/видалене відео — не збій yt-dlp (і серіалізується для пулу)
+            raise ContentUnavailable(str(e)) from None
+        raise
 
+    kind = KIND_AUDIO if audio_only else KIND_VIDEO
+    files = [
+        MediaFile(
+            d["filepath"],
+            kind,
+            duration=info.get("duration"),
+            width=None if audio_only else d.get("width") or info.get("width"),
+            height=None if audio_only else d.get("height") or info.get("height"),
+            title=info.get("title"),
+            uploader=info.get("uploader"),
+        )
+        for d in downloads
+        if d.get("filepath") and os.path.exists(d["filepath"])
+    ]
+    if not files or not audio_only:
+        return files or None, None, info_stale
 
-# --- INSTALOADER (ВАША ОРИГІНАЛЬНА ФУНКЦІЯ) ---
-def _download_instagram_post_sync(url: str, session_dir: str):
-    print("DEBUG: Instaloader starting...")
-    username = os.getenv("INSTAGRAM_USERNAME")
-    if not username:
-        raise ValueError("INSTAGRAM_USERNAME не встановлено у .env")
+    # Обкладинка — той файл, який yt-dlp записав через writethumbnail
+    thumbnail_path = next(
+        (
+            t["filepath"]
+            for t in reversed(info.get("thumbnails") or [])
+            if t.get("filepath") and os.path.exists(t["filepath"])
+        ),
+        None,
+    )
+    return files, {
+        "audio_path": files[0].path,
+        "thumbnail_path": thumbnail_path,
+        "title": info.get("title"),
+        "uploader": info.get("uploader"),
+        "cover_key": info.get("thumbnail") or info.get("id"),
+    }, info_stale
+
+
+async def _download_youtube_async(
+    url: str,
+    session_dir: str,
+    audio_only: bool,
+    max_height: Optional[int] = None,
+    progress_callback: Optional[Callable] = None,
+    http_session: Optional[aiohttp.ClientSession] = None,
+) -> Optional[List[MediaFile]]:
+    loop = asyncio.get_event_loop()
+    info_key = canonicalize_url(url)
+    info = get_info_cache().get(info_key)
+    try:
+        if _ytdlp_isolation() == "process":
+            files, audio_job, info_stale = await get_ytdlp_pool().run(
+                _download_generic_sync,
+                url,
+                session_dir,
+                audio_only,
+                max_height,
+                info,
+                on_progress=progress_callback,
+            )
+        else:
+            def notify(text: str):
+                if progress_callback:
+                    asyncio.run_coroutine_threadsafe(progress_callback(text), loop)
+
+            cancel = threading.Event()
+            try:
+                files, audio_job, info_stale = await loop.run_in_executor(
+                    get_ytdlp_executor(),
+                    lambda: _download_generic_sync(
+                        url, session_dir, audio_only, max_height, info, notify, cancel
+                    ),
+                )
+            except asyncio.CancelledError:
+                cancel.set()
+                raise
+    except Exception:
+        # Невдале завантаження не має лишати в кеші info, з яким воно падало
+        get_info_cache().delete(info_key)
+        raise
+    if info_stale:
+        # Наступні завантаження цього URL не мають отримати той самий протухлий info
+        get_info_cache().delete(info_key)
+    if files and audio_job:
+        # Обкладинка і теги — в пулі процесів, щоб не тримати GIL бота
+        timings = await loop.run_in_executor(
+            get_postprocess_pool(), functools.partial(process_audio, **audio_job)
+        )
+        record_timings(timings)
+        # Теги й обкладинка змінили розмір файлу
+        files[0].size = os.path.getsize(files[0].path)
+    return files
+
+
+# --- ПОПЕРЕДНЄ ОТРИМАННЯ МЕТАДАНИХ ---
+_info_cache: Optional[InfoCache] = None
+# Витяг, що вже йде, — щоб клавіатура, оцінка і завантаження чекали один
+_prefetching: Dict[str, asyncio.Future] = {}
+
+
+def get_info_cache() -> InfoCache:
+    global _info_cache
+    if _info_cache is None:
+        _info_cache = InfoCache(
+            max_entries=int(os.getenv("INFO_CACHE_SIZE", "32")),
+            ttl=float(os.getenv("INFO_CACHE_TTL", "1800")),
+        )
+    return _info_cache
+
+
+def _log_prefetch_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Prefetch error: {future.exception()}")
+
+
+def _extract_info_sync(url: str, notify: Optional[Callable] = None) -> dict:
+    """Витяг метаданих у воркері пулу; у кеш info кладе вже батьківський процес."""
     try:
-        L = instaloader.Instaloader(
-            download_pictures=True,
-            download_videos=True,
-            save_metadata=False,
-            compress_json=False,
-            # Ваша оригінальна схема імен
-            filename_pattern="{shortcode}_{date_utc}_UTC_{mediaid}",
-            # Додаємо User-Agent, щоб Інста менше блокувала
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        return extract_info(url)
+    except yt_dlp.utils.DownloadError as e:
+        if _is_unavailable_error(e):
+            raise ContentUnavailable(str(e)) from None
+        raise
+
+
+async def _extract_in_pool(url: str, key: str) -> dict:
+    # Парсинг сторінки теж може зависнути — YTDLP_JOB_TIMEOUT і killpg діють і тут
+    info = await get_ytdlp_pool().run(_extract_info_sync, url)
+    get_info_cache().put(key, info)
+    return info
+
+
+def prefetch_info(url: str) -> asyncio.Future:
+    """
+    Запускає extract_info у фоні (поки користувач обирає якість);
+    результат іде в InfoCache, звідки його беруть оцінка розміру й завантаження.
+    """
+    key = canonicalize_url(url)
+    loop = asyncio.get_event_loop()
+    future = _prefetching.get(key)
+    if future is not None:
+        return future
+    info = get_info_cache().get(key)
+    if info is not None:
+        future = loop.create_future()
+        future.set_result(info)
+        return future
+
+    if _ytdlp_isolation() == "process":
+        future = asyncio.ensure_future(_extract_in_pool(url, key))
+    else:
+        future = loop.run_in_executor(
+            get_ytdlp_executor(), extract_info_cached, get_info_cache(), url, key
         )
-        try:
-            L.load_session_from_file(username)
-            print("DEBUG: Session loaded successfully")
-        except FileNotFoundError:
-            print("DEBUG: Session file not found, trying without session")
-        except Exception as e:
-            print(f"DEBUG: Session load error: {e}")
+    future.add_done_callback(_log_prefetch_error)
+    future.add_done_callback(lambda _: _prefetching.pop(key, None))
+    _prefetching[key] = future
+    return future
+
+
+async def get_info(url: str) -> dict:
+    """Готовий info-dict з кешу, або дочікується / запускає витяг."""
+    return await asyncio.shield(prefetch_info(url))
+
+
+# --- ОЦІНКА РОЗМІРУ ДО ЗАВАНТАЖЕННЯ ---
+# Сходинки якості, по яких спускаємось, якщо файл не влазить у ліміт
+QUALITY_STEPS = [None, 1080, 720, 480, 360]
+
+
+def _estimate_format_size(fmt: dict, duration: Optional[float]) -> Optional[int]:
+    """filesize / filesize_approx / tbr * duration для кожного потоку формату."""
+    total = 0
+    for part in fmt.get("requested_formats") or [fmt]:
+        size = part.get("filesize") or part.get("filesize_approx")
+        if not size and part.get("tbr") and duration:
+            size = part["tbr"] * 1000 / 8 * duration
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+def _select_format(
+    ydl: yt_dlp.YoutubeDL, info: dict, audio_only: bool, max_height: Optional[int]
+) -> Optional[dict]:
+    """Той самий вибір формату, що й при завантаженні, але без скачування."""
+    formats = info.get("formats") or [info]
+    selector = ydl.build_format_selector(_format_spec(audio_only, max_height))
+    selected = list(
+        selector(
+            {
+                "formats": formats,
+                "has_merged_format": any(
+                    "none" not in (f.get("acodec"), f.get("vcodec")) for f in formats
+                ),
+                "incomplete_formats": all(f.get("vcodec") == "none" for f in formats)
+                or all(f.get("acodec") == "none" for f in formats),
+            }
+        )
+    )
+    return selected[0] if selected else None
 
+
+def _probe_youtube_sync(
+    info: dict, audio_only: bool, max_height: Optional[int], limit: int
+) -> Tuple[Optional[int], Optional[int]]:
+    ydl = yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True})
+    duration = info.get("duration")
+
+    if audio_only:
+        fmt = _select_format(ydl, info, True, None)
+        size = _estimate_format_size(fmt, duration) if fmt else None
+        if size and size > limit:
+            raise FileTooLarge(f"~{size} bytes > {limit}")
+        return max_height, size
+
+    steps = [h for h in QUALITY_STEPS if max_height is None or (h and h <= max_height)]
+    estimate = None
+    for height in steps:
+        fmt = _select_format(ydl, info, False, height)
+        if fmt is None:
+            continue
+        estimate = _estimate_format_size(fmt, duration)
+        if estimate is None or estimate <= limit:
+            # Розмір невідомий — не заважаємо, ліміт перевірить бот після
+            return height, estimate
+    if estimate is None:
+        return max_height, None
+    raise FileTooLarge(f"~{estimate} bytes > {limit} even at {steps[-1]}p")
+
+
+def _describe_qualities_sync(info: dict) -> dict:
+    ydl = yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True})
+    duration = info.get("duration")
+    heights = [f.get("height") for f in info.get("formats") or [] if f.get("height")]
+    top = max(heights) if heights else None
+
+    selected = {}
+    for height in QUALITY_STEPS:
+        # Вища за доступну якість дала б той самий файл, що й "найкраща"
+        if height is not None and top is not None and height >= top:
+            continue
+        fmt = _select_format(ydl, info, False, height)
+        if fmt is not None:
+            selected[height] = fmt
+
+    sizes = {}
+    seen = set()
+    # Знизу вгору: 480p, що насправді віддає 360p, не показуємо
+    for height in sorted(selected, key=lambda h: h or float("inf")):
+        fmt = selected[height]
+        if height is not None and fmt.get("format_id") in seen:
+            continue
+        seen.add(fmt.get("format_id"))
+        sizes[height] = _estimate_format_size(fmt, duration)
+    fmt = _select_format(ydl, info, True, None)
+    audio = _estimate_format_size(fmt, duration) if fmt else None
+    return {"top_height": top, "sizes": sizes, "audio": audio}
+
+
+async def describe_qualities(url: str) -> dict:
+    """
+    Для клавіатури: {"top_height": найвища висота, "sizes": {висота або None: байти},
+    "audio": байти}. Недоступних висот у sizes немає, розмір може бути None.
+    """
+    info = await get_info(url)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, _describe_qualities_sync, info)
+
+
+async def probe_download(
+    url: str, audio_only: bool, max_height: Optional[int], limit: int
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Оцінює розмір до завантаження і за потреби знижує якість.
+    Повертає (max_height, очікуваний розмір або None), а якщо навіть
+    найнижча якість не влазить у limit — кидає FileTooLarge.
+    Прямі завантаження (TikTok, Threads, Instagram) і так відсікаються
+    за Content-Length ще до читання тіла, тому тут тільки yt-dlp.
+    """
+    backend = registry.resolve(url)
+    if backend is None or not backend.quality:
+        return max_height, None
+    info = await get_info(url)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        None, lambda: _probe_youtube_sync(info, audio_only, max_height, limit)
+    )
+
+
+# --- INSTALOADER (ВАША ОРИГІНАЛЬНА ФУНКЦІЯ) ---
+INSTAGRAM_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+_instagram_pool: Optional[InstaloaderPool] = None
+
+
+def get_instagram_pool() -> InstaloaderPool:
+    global _instagram_pool
+    if _instagram_pool is None:
+        username = os.getenv("INSTAGRAM_USERNAME")
+        if not username:
+            raise ValueError("INSTAGRAM_USERNAME не встановлено у .env")
+        _instagram_pool = InstaloaderPool(
+            username=username,
+            user_agent=INSTAGRAM_USER_AGENT,
+            size=int(os.getenv("INSTAGRAM_CONTEXTS", "2")),
+        )
+    return _instagram_pool
+
+
+def instagram_pool_stats() -> Optional[dict]:
+    # Пул створюється з першим постом Instagram
+    if _instagram_pool is None:
+        return None
+    return dict(
+        _instagram_pool.stats, size=_instagram_pool.size, idle=_instagram_pool.idle()
+    )
+
+
+def shutdown_instagram_pool():
+    global _instagram_pool
+    if _instagram_pool is not None:
+        _instagram_pool.close()
+        _instagram_pool = None
+
+
+def _resolve_instagram_post_sync(
+    L: instaloader.Instaloader, url: str
+) -> List[Tuple[str, str]]:
+    """Через Instaloader отримує список (media_url, ext) поста в порядку каруселі."""
+    print("DEBUG: Instaloader starting...")
+    try:
         # Витягуємо shortcode
         match = re.search(r"instagram\.com/(?:p|reel|tv)/([^/?#&]+)", url)
         if match:
@@ -243,82 +798,156 @@ def _download_instagram_post_sync(url: str, session_dir: str):
             # Fallback
             shortcode = url.split("/")[-2]
 
-        print(f"DEBUG: Downloading shortcode {shortcode}")
+        print(f"DEBUG: Resolving shortcode {shortcode}")
         post = instaloader.Post.from_shortcode(L.context, shortcode)
-        L.download_post(post, target=Path(session_dir))
+        if post.typename == "GraphSidecar":
+            nodes = [
+                (node.video_url, ".mp4") if node.is_video else (node.display_url, ".jpg")
+                for node in post.get_sidecar_nodes()
+            ]
+        elif post.is_video:
+            nodes = [(post.video_url, ".mp4")]
+        else:
+            nodes = [(post.url, ".jpg")]
         print("DEBUG: Instaloader finished")
+        return [(media_url, ext) for media_url, ext in nodes if media_url]
     except Exception as e:
         print(f"Error: {e}")
         raise
 
 
 async def _download_instagram_post_async(
-    url: str, session_dir: str
-) -> Optional[List[str]]:
-    loop = asyncio.get_event_loop()
+    url: str,
+    session_dir: str,
+    audio_only: bool = False,
+    max_height: Optional[int] = None,
+    progress_callback: Optional[Callable] = None,
+    http_session: Optional[aiohttp.ClientSession] = None,
+) -> Optional[List[MediaFile]]:
     try:
-        # Виконуємо синхронну функцію в окремому потоці
-        await loop.run_in_executor(
-            None, lambda: _download_instagram_post_sync(url, session_dir)
+        # Метадані — в потоці на готовому контексті з пулу, самі файли — паралельно
+        media = await get_instagram_pool().run(
+            lambda L: _resolve_instagram_post_sync(L, url)
         )
-        allowed_extensions = [".jpg", ".jpeg", ".png", ".webp", ".mp4", ".mov"]
+        items = [
+            (media_url, os.path.join(session_dir, f"instagram_{i}{ext}"))
+            for i, (media_url, ext) in enumerate(media)
+        ]
+        async with session_scope(http_session) as session:
+            paths = await fetch_many(
+                session, items, headers={"User-Agent": INSTAGRAM_USER_AGENT}
+            )
         files = [
-            os.path.join(session_dir, f)
-            for f in os.listdir(session_dir)
-            if os.path.splitext(f)[1].lower() in allowed_extensions
+            MediaFile(path, KIND_VIDEO if ext == ".mp4" else KIND_PHOTO)
+            for path, (_, ext) in zip(paths, media)
+            if path
         ]
-        return files
+        return files if files else None
     except Exception as e:
         print(f"Error: {e}")
-        return None
+        if is_missing_content(e):
+            raise ContentUnavailable(str(e)) from e
+        # Решту (блокування, авторизація, мережа) рахує запобіжник
+        raise
 
 
-async def _download_tiktok_async(url: str, session_dir: str) -> Optional[List[str]]:
+async def _download_tiktok_async(
+    url: str,
+    session_dir: str,
+    audio_only: bool = False,
+    max_height: Optional[int] = None,
+    progress_callback: Optional[Callable] = None,
+    http_session: Optional[aiohttp.ClientSession] = None,
+) -> Optional[List[MediaFile]]:
     api_url = "https://www.tikwm.com/api/"
     params = {"url": url, "hd": 1}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url, data=params) as resp:
-                if resp.status != 200:
-                    print(f"TikWM Error: {resp.status}")
-                    return None
-                data = await resp.json()
-
-        if data.get("code") != 0:
-            print(f"TikWM API Error: {data.get('msg')}")
-            return None
+        # Одна (спільна) сесія і для API, і для медіа
+        async with session_scope(http_session) as session:
+            try:
+                async with session.post(api_url, data=params) as resp:
+                    if _is_transient_status(resp.status):
+                        raise TransientError(f"TikWM HTTP {resp.status}")
+                    if resp.status != 200:
+                        print(f"TikWM Error: {resp.status}")
+                        raise BackendError(f"TikWM HTTP {resp.status}")
+                    data = await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise TransientError(f"TikWM network error: {e}") from e
 
-        data_obj = data.get("data", {})
-        images = data_obj.get("images")
-        video = data_obj.get("play")
+            if data.get("code") != 0:
+                msg = str(data.get("msg"))
+                print(f"TikWM API Error: {msg}")
+                if "limit" in msg.lower():
+                    # "Free Api Limit: 1 request/second" — просто зачекати
+                    raise TransientError(f"TikWM: {msg}")
+                capture_failure("tiktok", url, json.dumps(data), ext="json", reason=msg)
+                # Хибне/видалене посилання: TikWM відповів як слід
+                raise ContentUnavailable(f"TikWM: {msg}")
+
+            data_obj = data.get("data", {})
+            images = data_obj.get("images")
+            video = data_obj.get("play")
+            if not images and not video:
+                capture_failure(
+                    "tiktok", url, json.dumps(data), ext="json", reason="no media in response"
+                )
+                # code == 0, але без медіа — змінився формат відповіді API
+                raise BackendError("TikWM: no media in response")
 
-        downloaded_files = []
+            downloaded_files = []
+            title = data_obj.get("title")
+            uploader = (data_obj.get("author") or {}).get("nickname")
 
-        async with aiohttp.ClientSession() as session:
             if images:
-                for i, img_url in enumerate(images):
-                    async with session.get(img_url) as img_resp:
-                        if img_resp.status == 200:
-                            path = os.path.join(session_dir, f"image_{i}.jpg")
-                            with open(path, "wb") as f:
-                                f.write(await img_resp.read())
-                            downloaded_files.append(path)
+                items = [
+                    (img_url, os.path.join(session_dir, f"image_{i}.jpg"))
+                    for i, img_url in enumerate(images)
+                ]
+                paths = await fetch_many(session, items)
+                downloaded_files = [
+                    MediaFile(path, KIND_PHOTO, title=title, uploader=uploader)
+                    for path in paths
+                    if path
+                ]
             elif video:
-                async with session.get(video) as vid_resp:
-                    if vid_resp.status == 200:
-                        path = os.path.join(session_dir, "video.mp4")
-                        with open(path, "wb") as f:
-                            f.write(await vid_resp.read())
-                        downloaded_files.append(path)
+                path = os.path.join(session_dir, "video.mp4")
+                try:
+                    # Обрив посеред HD-відео докачується з .part / .ranged
+                    await fetch_with_retries(session, video, path, ranged=True)
+                except aiohttp.ClientResponseError as e:
+                    if _is_transient_status(e.status):
+                        raise TransientError(f"TikTok CDN HTTP {e.status}") from e
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # Збій CDN, а не TikWM: повторюємо, а не вимикаємо бекенд
+                    raise TransientError(f"TikTok CDN network error: {e}") from e
+                downloaded_files.append(
+                    MediaFile(
+                        path,
+                        KIND_VIDEO,
+                        duration=data_obj.get("duration"),
+                        title=title,
+                        uploader=uploader,
+                    )
+                )
 
         return downloaded_files if downloaded_files else None
 
     except Exception as e:
+        # Класифікує і за потреби повторює шар надійності в _download_media_once
         print(f"TikTok Download Error: {e}")
-        return None
+        raise
 
 
-async def _download_threads_async(url: str, session_dir: str) -> Optional[List[str]]:
+async def _download_threads_async(
+    url: str,
+    session_dir: str,
+    audio_only: bool = False,
+    max_height: Optional[int] = None,
+    progress_callback: Optional[Callable] = None,
+    http_session: Optional[aiohttp.ClientSession] = None,
+) -> Optional[List[MediaFile]]:
     # Fix potential domain typo (threads.com -> threads.net)
     url = re.sub(r"threads\.com", "threads.net", url, flags=re.IGNORECASE)
 
@@ -331,188 +960,386 @@ async def _download_threads_async(url: str, session_dir: str) -> Optional[List[s
 
     print(f"Fetching Threads URL: {url}")
 
-    async with aiohttp.ClientSession() as session:
+    async with session_scope(http_session) as session:
         try:
             async with session.get(url, headers=headers) as response:
+                if _is_transient_status(response.status):
+                    raise TransientError(f"Threads HTTP {response.status}")
+                text = await response.text()
                 if response.status != 200:
                     print(f"Threads page load failed: {response.status}")
-                    return None
-                text = await response.text()
-        except Exception as e:
-            print(f"Threads network error: {e}")
-            return None
-
-        # Extract unique media URLs
-        media_urls = set()
+                    capture_failure(
+                        "threads", url, text, reason=f"HTTP {response.status}"
+                    )
+                    if response.status == 404:
+                        raise ContentUnavailable("Threads post not found")
+                    raise BackendError(f"Threads HTTP {response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransientError(f"Threads network error: {e}") from e
 
         # Extract shortcode to isolate the specific post
         shortcode_match = re.search(r"/post/([^/?#]+)", url)
-        shortcode = shortcode_match.group(1) if shortcode_match else None
-
-        if shortcode:
-            # Scoped extraction via data-sjs JSON injection
-            # Matches <script ... data-sjs >...
-            pattern = re.compile(r"<script[^>]*data-sjs[^>]*>(.*?)</script>", re.DOTALL)
-            matches = pattern.findall(text)
-
-            target_node = None
-            for json_text in matches:
-                try:
-                    data = json.loads(json_text)
-                    found = _find_node_with_code(data, shortcode)
-                    if found:
-                        target_node = found
-                        break
-                except Exception:
-                    pass
-
-            if target_node:
-                print(f"Extraction: Found precise node for shortcode {shortcode}")
-
-                # Helper to extract best URL
-                def extract_best_url(node, key):
-                    if key == "video_versions" and node.get(key):
-                        return node[key][0]["url"]
-                    if key == "image_versions2" and node.get(key):
-                        cands = node[key].get("candidates", [])
-                        if cands:
-                            # Sort by width DESC
-                            cands.sort(key=lambda x: x.get("width", 0), reverse=True)
-                            return cands[0]["url"]
-                    return None
-
-                # 1. Carousel
-                if target_node.get("carousel_media"):
-                    for item in target_node["carousel_media"]:
-                        v_url = extract_best_url(item, "video_versions")
-                        if v_url:
-                            media_urls.add(v_url)
-                        else:
-                            i_url = extract_best_url(item, "image_versions2")
-                            if i_url:
-                                media_urls.add(i_url)
-
-                # 2. Single Video
-                v_url = extract_best_url(target_node, "video_versions")
-                if v_url:
-                    media_urls.add(v_url)
-                elif not target_node.get("carousel_media"):
-                    # 3. Single Image
-                    i_url = extract_best_url(target_node, "image_versions2")
-                    if i_url:
-                        media_urls.add(i_url)
-            else:
-                print("DEBUG: Could not locate post payload in page scripts.")
-        else:
+        if not shortcode_match:
             print("Could not parse shortcode from URL.")
+            raise ContentUnavailable("no Threads post shortcode in URL")
+        shortcode = shortcode_match.group(1)
+
+        # Розбираємо лише data-sjs скрипти, де є shortcode, обхід без рекурсії
+        loop = asyncio.get_event_loop()
+        target_node = await loop.run_in_executor(None, find_post_node, text, shortcode)
+        if not target_node:
+            print("DEBUG: Could not locate post payload in page scripts.")
+            # Сторінка стане фікстурою для benchmarks/threads_parser.py
+            capture_failure("threads", url, text, reason="post payload not found")
+            # Сторінка є, а поста в ній немає — найімовірніше, змінилась розмітка
+            raise BackendError("Threads post payload not found in page")
 
+        print(f"Extraction: Found precise node for shortcode {shortcode}")
+        media_urls = extract_media_urls(target_node)
         if not media_urls:
             print("No media found in Threads scraping (Precise Mode).")
-            # DEBUG: Dump text
-            with open("debug_threads_fail.html", "w") as f:
-                f.write(text)
-            return None
-
-        final_paths = []
+            capture_failure("threads", url, text, reason="no media in post")
+            # Текстовий пост без фото/відео
+            raise ContentUnavailable("Threads post has no media")
 
         # Limit the number of downloads to top 10 to avoid blasting
-        download_queue = list(media_urls)[:10]
+        download_queue = media_urls[:10]
 
+        items = []
+        kinds = []
         for i, m_url in enumerate(download_queue):
             # Determine extension
-            ext = ".mp4" if ".mp4" in m_url or "_mp4" in m_url else ".jpg"
-            filename = f"threads_{int(time.time())}_{i}{ext}"
-            filepath = os.path.join(session_dir, filename)
+            is_video = ".mp4" in m_url or "_mp4" in m_url
+            ext = ".mp4" if is_video else ".jpg"
+            # Стале ім'я: після перезапуску job докачує свій .part
+            filename = f"threads_{i}{ext}"
+            items.append((m_url, os.path.join(session_dir, filename)))
+            kinds.append(KIND_VIDEO if is_video else KIND_PHOTO)
 
-            try:
-                print(f"Downloading media: {m_url}")
-                async with session.get(m_url) as resp:
-                    if resp.status == 200:
-                        with open(filepath, "wb") as f:
-                            while True:
-                                chunk = await resp.content.read(1024 * 1024)
-                                if not chunk:
-                                    break
-                                f.write(chunk)
-                        final_paths.append(filepath)
-                    else:
-                        print(f"Failed to download media item: {resp.status}")
-            except Exception as e:
-                print(f"Error downloading specific item: {e}")
-
-        return final_paths if final_paths else None
+        print(f"Downloading {len(items)} media items")
+        paths = await fetch_many(session, items, ranged=True)
+        final_files = [
+            MediaFile(path, kind) for path, kind in zip(paths, kinds) if path
+        ]
+
+        return final_files if final_files else None
+
+
+# --- РЕЄСТР БЕКЕНДІВ ---
+registry.register(
+    Backend(
+        "youtube",
+        "YouTube",
+        hosts=["youtube.com", "youtu.be", "music.youtube.com"],
+        download=_download_youtube_async,
+        audio=True,
+        quality=True,
+        concurrency=2,
+        audio_hosts=["music.youtube.com"],
+        direct_paths=["/shorts/"],
+        canonicalize=_canonical_youtube,
+    )
+)
+registry.register(
+    Backend(
+        "instagram",
+        "Instagram",
+        hosts=["instagram.com"],
+        download=_download_instagram_post_async,
+        concurrency=1,
+        keep_query=False,
+        start_text="📥 *Завантаження через Instaloader...*",
+    )
+)
+registry.register(
+    Backend(
+        "tiktok",
+        "TikTok",
+        hosts=["tiktok.com"],
+        download=_download_tiktok_async,
+        concurrency=3,
+        keep_query=False,
+        start_text="📥 *Завантаження TikTok...*",
+    )
+)
+registry.register(
+    Backend(
+        "threads",
+        "Threads",
+        hosts=["threads.net", "threads.com"],
+        download=_download_threads_async,
+        concurrency=2,
+        host_aliases={"threads.com": "threads.net"},
+        keep_query=False,
+        start_text="📥 *Завантаження Threads...*",
+    )
+)
+
+
+def register_extra_sites():
+    # Інші сайти yt-dlp вимкнені; YTDLP_EXTRA_SITES вмикає відео-сайти,
+    # YTDLP_AUDIO_SITES — музичні (посилання одразу качається як аудіо)
+    def hosts(name: str) -> List[str]:
+        return [h.strip().lower() for h in os.getenv(name, "").split(",") if h.strip()]
+
+    if registry.get("ytdlp") is not None:
+        return
+
+    def unrouted(names: List[str]) -> List[str]:
+        free = []
+        for host in dict.fromkeys(names):
+            owner = registry.match_host(host)
+            if owner is not None:
+                # Хост уже обслуговує вбудований бекенд — не падаємо на старті
+                print(f"{host} is already handled by {owner.name}, skipped")
+                continue
+            free.append(host)
+        return free
+
+    audio_hosts = unrouted(hosts("YTDLP_AUDIO_SITES"))
+    video_hosts = [
+        h for h in unrouted(hosts("YTDLP_EXTRA_SITES")) if h not in audio_hosts
+    ]
+    if video_hosts or audio_hosts:
+        registry.register(
+            Backend(
+                "ytdlp",
+                ", ".join(video_hosts + audio_hosts),
+                hosts=video_hosts + audio_hosts,
+                download=_download_youtube_async,
+                audio=True,
+                quality=True,
+                concurrency=1,
+                audio_hosts=audio_hosts,
+            )
+        )
 
 
 # --- MAIN ENTRY ---
-async def download_media(
+def _media_cache_key(url: str, audio_only: bool, max_height: Optional[int]) -> str:
+    return get_media_cache().make_key(
+        canonicalize_url(url), audio_only, max_height, audio_variant(audio_only)
+    )
+
+
+async def is_cached(url: str, audio_only: bool, max_height: Optional[int]) -> bool:
+    """Чи віддасть download_media файли з кешу (тоді оцінка розміру не потрібна)."""
+    loop = asyncio.get_event_loop()
+    key = _media_cache_key(url, audio_only, max_height)
+    return await loop.run_in_executor(None, get_media_cache().contains, key)
+
+
+async def _download_media_once(
     url: str,
     audio_only: bool = False,
     max_height: Optional[int] = None,
     progress_callback: Optional[Callable] = None,
-) -> Optional[List[str]]:
-    base_dir = "downloads"
-    session_dir = os.path.join(base_dir, str(time.time_ns()))
+    session_dir: Optional[str] = None,
+    http_session: Optional[aiohttp.ClientSession] = None,
+) -> Optional[List[MediaFile]]:
+    # Після перезапуску job отримує ту саму папку — yt-dlp докачає .part файли
+    session_dir = session_dir or new_session_dir()
     os.makedirs(session_dir, exist_ok=True)
     loop = asyncio.get_event_loop()
 
-    url_lower = url.lower()
+    backend = registry.resolve(url)
+
+    cache = get_media_cache()
+    cache_key = _media_cache_key(url, audio_only, max_height)
+    cached = await loop.run_in_executor(None, cache.fetch, cache_key, session_dir)
+    if cached:
+        if progress_callback:
+            await progress_callback("⚡ *Знайдено в кеші...*")
+        return cached
+
+    async def on_retry(attempt: int, delay: float):
+        if progress_callback:
+            await progress_callback(f"🔁 *Тимчасовий збій, повтор {attempt}...*")
+
+    if backend is None:
+        if progress_callback:
+            supported = ", ".join(b.label for b in registry.all())
+            await progress_callback(
+                f"❌ Цей сервіс зараз не підтримується.\nПрацює тільки {supported}."
+            )
+        # Затримка, щоб користувач встиг прочитати повідомлення перед видаленням
+        await asyncio.sleep(5)
+        return None
 
     try:
-        # 1. Instagram -> Instaloader
-        if "instagram.com" in url_lower:
-            if progress_callback:
-                await progress_callback("📥 *Завантаження через Instaloader...*")
-            return await _download_instagram_post_async(url, session_dir)
-
-        # 2. TikTok -> TikWM
-        elif "tiktok.com" in url_lower:
-            if progress_callback:
-                await progress_callback("📥 *Завантаження TikTok...*")
-            return await _download_tiktok_async(url, session_dir)
-
-        # 3. Threads -> Cobalt
-        elif "threads.net" in url_lower or "threads.com" in url_lower:
-            if progress_callback:
-                await progress_callback("📥 *Завантаження Threads...*")
-            return await _download_threads_async(url, session_dir)
-
-        # 4. YouTube -> YT-DLP
-        elif "youtube.com" in url_lower or "youtu.be" in url_lower:
-            return await loop.run_in_executor(
-                None,
-                lambda: _download_generic_sync(
-                    url, session_dir, audio_only, max_height, progress_callback, loop
-                ),
+        if progress_callback and backend.start_text:
+            await progress_callback(backend.start_text)
+
+        def download():
+            return backend.download(
+                url, session_dir, audio_only, max_height, progress_callback, http_session
             )
 
-        # 5. Інші сервіси (відключено за запитом)
-        else:
-            if progress_callback:
-                await progress_callback(
-                    "❌ Цей сервіс зараз не підтримується.\nПрацює тільки YouTube, Instagram, TikTok, Threads."
-                )
-            # Затримка, щоб користувач встиг прочитати повідомлення перед видаленням
-            await asyncio.sleep(5)
-            return None
+        # Повтори тимчасових збоїв і запобіжник бекенда
+        files = await get_resilience().call(backend.name, download, on_retry=on_retry)
 
+    except ContentUnavailable as e:
+        # Приватний/видалений пост чи хибне посилання — не збій, traceback не потрібен
+        print(f"Content unavailable: {e}")
+        shutil.rmtree(session_dir, ignore_errors=True)
+        return None
+    except FileTooLarge as e:
+        # Не помилка бекенда: бот скаже користувачу, чому файла не буде
+        print(f"File too large: {e}")
+        shutil.rmtree(session_dir, ignore_errors=True)
+        raise
+    except CircuitOpenError:
+        print(f"Circuit open for {backend.name}, request rejected")
+        if progress_callback:
+            await progress_callback(
+                "⚠️ Сервіс зараз масово не відповідає, спробуйте за хвилину."
+            )
+        shutil.rmtree(session_dir, ignore_errors=True)
+        return None
     except Exception as e:
         print(f"Error: {e}")
+        capture_failure(
+            backend.name, url, traceback.format_exc(), ext="txt", reason=str(e)
+        )
+        if isinstance(e, (TransientError, aiohttp.ClientError, asyncio.TimeoutError)):
+            # Мережа/5xx: .part і .ranged лишаються, щоб наступна спроба з тією
+            # самою session_dir докачала файл; прибирає папку той, хто її дав
+            return None
         if os.path.exists(session_dir):
             shutil.rmtree(session_dir)
         return None
 
+    if files:
+        try:
+            await loop.run_in_executor(None, cache.store, cache_key, url, files)
+        except Exception as e:
+            print(f"Cache store error: {e}")
+    return files
 
-def _find_node_with_code(data, code):
-    if isinstance(data, dict):
-        if data.get("code") == code:
-            return data
-        for k, v in data.items():
-            res = _find_node_with_code(v, code)
-            if res:
-                return res
-    elif isinstance(data, list):
-        for item in data:
-            res = _find_node_with_code(item, code)
-            if res:
-                return res
-    return None
+
+# --- ОБ'ЄДНАННЯ ОДНАКОВИХ ЗАПИТІВ (SINGLE-FLIGHT) ---
+class _Flight:
+    """Одне активне завантаження, на яке чекають кілька чатів."""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.listeners: List[Callable] = []
+        self.last_text: Optional[str] = None
+        self.waiters = 0
+
+    async def broadcast(self, text: str):
+        self.last_text = text
+        listeners = list(self.listeners)
+        if listeners:
+            await asyncio.gather(*(cb(text) for cb in listeners), return_exceptions=True)
+
+
+_in_flight: dict = {}
+
+
+def in_flight_count() -> int:
+    return len(_in_flight)
+
+
+def is_in_flight(url: str, audio_only: bool, max_height: Optional[int]) -> bool:
+    return (canonicalize_url(url), bool(audio_only), max_height or 0) in _in_flight
+
+
+async def _run_flight(
+    key, flight: _Flight, url, audio_only, max_height, session_dir, http_session
+):
+    session_dir = session_dir or new_session_dir()
+    try:
+        files = await _download_media_once(
+            url,
+            audio_only,
+            max_height,
+            progress_callback=flight.broadcast,
+            session_dir=session_dir,
+            http_session=http_session,
+        )
+    except asyncio.CancelledError:
+        # Усі чати скасували — недокачане нікому не потрібне
+        shutil.rmtree(session_dir, ignore_errors=True)
+        raise
+    finally:
+        # Після завершення нові запити йдуть уже через кеш
+        _in_flight.pop(key, None)
+    if files and flight.waiters == 0:
+        # Усі чати встигли скасувати очікування — файли нікому не потрібні
+        shutil.rmtree(os.path.dirname(files[0].path), ignore_errors=True)
+    return files
+
+
+def _link_files(
+    files: List[MediaFile], session_dir: Optional[str] = None
+) -> List[MediaFile]:
+    session_dir = session_dir or new_session_dir()
+    os.makedirs(session_dir, exist_ok=True)
+    linked = []
+    for media in files:
+        dst = os.path.join(session_dir, media.name)
+        link_or_copy(media.path, dst)
+        linked.append(media.with_path(dst))
+    return linked
+
+
+async def _claim_files(
+    flight: _Flight, files: List[MediaFile], session_dir: Optional[str] = None
+) -> List[MediaFile]:
+    """Видає чату власну копію файлів (hardlink); хто лишився останнім — забирає оригінал."""
+    if flight.waiters == 1:
+        flight.waiters = 0
+        return files
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(None, _link_files, files, session_dir)
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0:
+            shutil.rmtree(os.path.dirname(files[0].path), ignore_errors=True)
+
+
+async def download_media(
+    url: str,
+    audio_only: bool = False,
+    max_height: Optional[int] = None,
+    progress_callback: Optional[Callable] = None,
+    session_dir: Optional[str] = None,
+    http_session: Optional[aiohttp.ClientSession] = None,
+) -> Optional[List[MediaFile]]:
+    key = (canonicalize_url(url), bool(audio_only), max_height or 0)
+    flight = _in_flight.get(key)
+    is_leader = flight is None
+    if is_leader:
+        flight = _Flight()
+        _in_flight[key] = flight
+        flight.task = asyncio.ensure_future(
+            _run_flight(
+                key, flight, url, audio_only, max_height, session_dir, http_session
+            )
+        )
+
+    flight.waiters += 1
+    if progress_callback:
+        flight.listeners.append(progress_callback)
+    try:
+        if progress_callback and flight.last_text:
+            await progress_callback(flight.last_text)
+        # shield: скасування одного чату не зупиняє спільне завантаження
+        files = await asyncio.shield(flight.task)
+    except BaseException:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # Більше ніхто не чекає — зупиняємо сам бекенд (воркер, ffmpeg, aiohttp)
+            flight.task.cancel()
+        raise
+    finally:
+        if progress_callback in flight.listeners:
+            flight.listeners.remove(progress_callback)
+
+    if not files:
+        flight.waiters -= 1
+        return None
+    # Лідер качав прямо в свою session_dir, тому копіює в нову папку
+    return await _claim_files(flight, files, None if is_leader else session_dir)
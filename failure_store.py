@@ -0,0 +1,126 @@
+# failure_store.py
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import List, Optional, Union
+
+
+# --- СХОВИЩЕ ЗБОЇВ ПАРСЕРІВ ---
+class FailureStore:
+    """
+    Знімки сторінок/відповідей API, на яких бекенд не знайшов медіа.
+
+    Кожен знімок — gzip-файл <root>/<backend>/<час>_<хеш>.<ext>.gz і поруч
+    <те саме ім'я>.json з метаданими (URL, бекенд, причина, час). Тека
+    обмежена за сумарним розміром і кількістю знімків: найстаріші
+    видаляються. Сторінки Threads з неї читає benchmarks/threads_parser.py.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_files: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.captured = 0
+        self.rotated = 0
+        # Лічильник в імені: кілька збоїв одного URL за мілісекунду (серія
+        # повторів) не мають перезаписати один одного
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.max_files > 0
+
+    def capture(
+        self,
+        backend: str,
+        url: str,
+        payload: Union[str, bytes],
+        ext: str = "html",
+        reason: str = "",
+    ) -> Optional[str]:
+        """Записує знімок (синхронно — викликати з executor) і повертає шлях."""
+        if not self.enabled:
+            return None
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8", errors="replace")
+
+        directory = os.path.join(self.root, backend)
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        # Без крапок: усе до першої "." — спільна основа файлів знімка
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        stamp = f"{stamp}{int(now * 1000) % 1000:03d}-{seq % 10000:04d}"
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+        base = os.path.join(directory, f"{stamp}_{digest}")
+        data_path = f"{base}.{ext}.gz"
+
+        # Спершу в .tmp: недописаний знімок не має потрапити у фікстури
+        with gzip.open(data_path + ".tmp", "wb", compresslevel=6) as f:
+            f.write(payload)
+        os.replace(data_path + ".tmp", data_path)
+        meta = {
+            "url": url,
+            "backend": backend,
+            "reason": reason,
+            "timestamp": now,
+            "size": len(payload),
+            "file": os.path.basename(data_path),
+        }
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        with self._lock:
+            self.captured += 1
+            self._rotate()
+        return data_path
+
+    def _snapshots(self) -> List[tuple]:
+        """(mtime, розмір, [файли знімка]) для всіх знімків, найстаріші першими."""
+        groups = {}
+        if not os.path.isdir(self.root):
+            return []
+        for backend in os.listdir(self.root):
+            directory = os.path.join(self.root, backend)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                # <час>_<хеш>.json і <час>_<хеш>.<ext>.gz — один знімок
+                base = os.path.join(directory, name.split(".", 1)[0])
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                mtime, size, paths = groups.get(base, (st.st_mtime, 0, []))
+                groups[base] = (min(mtime, st.st_mtime), size + st.st_size, paths + [path])
+        return sorted(groups.values(), key=lambda g: g[0])
+
+    def _rotate(self):
+        snapshots = self._snapshots()
+        total = sum(size for _, size, _ in snapshots)
+        while snapshots and (total > self.max_bytes or len(snapshots) > self.max_files):
+            _, size, paths = snapshots.pop(0)
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self.rotated += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshots = self._snapshots()
+        return {
+            "entries": len(snapshots),
+            "size_bytes": sum(size for _, size, _ in snapshots),
+            "captured": self.captured,
+            "rotated": self.rotated,
+        }
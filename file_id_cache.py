@@ -0,0 +1,116 @@
+# file_id_cache.py
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+# (kind, file_id), де kind — "audio" / "video" / "photo" / "document"
+SentItem = Tuple[str, str]
+
+
+# --- КЕШ TELEGRAM FILE_ID ---
+class FileIdCache:
+    """
+    Зберігає file_id вже надісланих файлів у SQLite.
+
+    Ключ — (канонічний URL, audio_only, max_height, variant), де variant —
+    режим аудіо (native/mp3). Повторний запит відправляється за file_id
+    без завантаження і без аплоаду.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = [
+            row[1] for row in self._conn.execute("PRAGMA table_info(file_ids)")
+        ]
+        if columns and "variant" not in columns:
+            # Стара схема без variant; це лише кеш — простіше почати заново
+            self._conn.execute("DROP TABLE file_ids")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_ids (
+                url TEXT NOT NULL,
+                audio_only INTEGER NOT NULL,
+                max_height INTEGER NOT NULL,
+                variant TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (url, audio_only, max_height, variant, position)
+            )
+            """
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        url: str,
+        audio_only: bool,
+        max_height: Optional[int],
+        variant: str = "",
+    ) -> Optional[List[SentItem]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, file_id FROM file_ids "
+                "WHERE url = ? AND audio_only = ? AND max_height = ? AND variant = ? "
+                "ORDER BY position",
+                (url, int(audio_only), max_height or 0, variant),
+            ).fetchall()
+            if rows:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return [(kind, file_id) for kind, file_id in rows] or None
+
+    def put(
+        self,
+        url: str,
+        audio_only: bool,
+        max_height: Optional[int],
+        items: List[SentItem],
+        variant: str = "",
+    ):
+        if not items:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM file_ids "
+                "WHERE url = ? AND audio_only = ? AND max_height = ? AND variant = ?",
+                (url, int(audio_only), max_height or 0, variant),
+            )
+            self._conn.executemany(
+                "INSERT INTO file_ids VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (url, int(audio_only), max_height or 0, variant, i, kind, file_id, now)
+                    for i, (kind, file_id) in enumerate(items)
+                ],
+            )
+
+    def delete(
+        self,
+        url: str,
+        audio_only: bool,
+        max_height: Optional[int],
+        variant: str = "",
+    ):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM file_ids "
+                "WHERE url = ? AND audio_only = ? AND max_height = ? AND variant = ?",
+                (url, int(audio_only), max_height or 0, variant),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute(
+                "SELECT COUNT(DISTINCT "
+                "url || '|' || audio_only || '|' || max_height || '|' || variant) "
+                "FROM file_ids"
+            ).fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
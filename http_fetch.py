@@ -0,0 +1,618 @@
+# http_fetch.py
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+
+import aiohttp
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+# --- НАЛАШТУВАННЯ ---
+def _chunk_size() -> int:
+    return int(os.getenv("FETCH_CHUNK_KB", "256")) * 1024
+
+
+def _max_file_bytes() -> int:
+    # Той самий ліміт, що і в локального Bot API сервера
+    return int(os.getenv("FETCH_MAX_FILE_MB", "2000")) * 1024 * 1024
+
+
+def _concurrency() -> int:
+    return int(os.getenv("FETCH_CONCURRENCY", "4"))
+
+
+def _idle_timeout() -> float:
+    # Скільки секунд можна чекати на наступний шматок даних
+    return float(os.getenv("FETCH_IDLE_TIMEOUT", "60"))
+
+
+def _item_retries() -> int:
+    return int(os.getenv("FETCH_RETRIES", "2"))
+
+
+def _segments() -> int:
+    # 1 — вимкнено (звичайний потік)
+    return int(os.getenv("FETCH_SEGMENTS", "1"))
+
+
+def _ranged_min_bytes() -> int:
+    return int(os.getenv("FETCH_RANGED_MIN_MB", "16")) * 1024 * 1024
+
+
+# --- СТАТИСТИКА ---
+_stats = {
+    "files": 0,
+    "bytes": 0,
+    "rejected": 0,
+    "retries": 0,
+    "ranged": 0,
+    "resumed": 0,
+}
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # ru_maxrss у кілобайтах на Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def fetch_stats() -> dict:
+    return {**_stats, "peak_rss_mb": _peak_rss_mb()}
+
+
+# --- СПІЛЬНИЙ HTTP-КЛІЄНТ ---
+class HttpClient:
+    """
+    Одна aiohttp-сесія на весь час роботи бота: keep-alive пул з лімітом
+    на хост і кешем DNS, щоб кожен job не платив за нові TCP/TLS з'єднання.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 8,
+        dns_ttl: int = 300,
+        connect_timeout: float = 15,
+        read_timeout: float = 60,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = aiohttp.ClientTimeout(
+            total=None, connect=connect_timeout, sock_read=read_timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._counters = {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "dns_hits": 0,
+            "dns_misses": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "HttpClient":
+        return cls(
+            limit=int(os.getenv("HTTP_POOL_LIMIT", "100")),
+            limit_per_host=int(os.getenv("HTTP_POOL_PER_HOST", "8")),
+            dns_ttl=int(os.getenv("HTTP_DNS_TTL", "300")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "15")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "60")),
+        )
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        def counter(name):
+            async def handler(session, ctx, params):
+                self._counters[name] += 1
+
+            return handler
+
+        trace.on_request_start.append(counter("requests"))
+        trace.on_connection_create_end.append(counter("new_connections"))
+        trace.on_connection_reuseconn.append(counter("reused_connections"))
+        trace.on_dns_cache_hit.append(counter("dns_hits"))
+        trace.on_dns_cache_miss.append(counter("dns_misses"))
+        return trace
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Створюємо ліниво всередині запущеного event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trace_configs=[self._trace_config()],
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self) -> dict:
+        stats = {
+            **self._counters,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "active": 0,
+        }
+        if self._session is not None and not self._session.closed:
+            connector = self._session.connector
+            stats["active"] = len(getattr(connector, "_acquired", ()))
+        return stats
+
+
+@asynccontextmanager
+async def session_scope(
+    session: Optional[aiohttp.ClientSession],
+) -> AsyncIterator[aiohttp.ClientSession]:
+    """Спільна сесія, якщо її передали, інакше тимчасова (для CLI та тестів)."""
+    if session is not None:
+        yield session
+    else:
+        async with aiohttp.ClientSession() as temp_session:
+            yield temp_session
+
+
+def idle_timeout(
+    session: aiohttp.ClientSession, seconds: Optional[float] = None
+) -> aiohttp.ClientTimeout:
+    """
+    Тайм-аут без обмеження загального часу: обривається лише з'єднання,
+    з якого seconds секунд не прийшло жодного байта. Великий файл на
+    повільному, але живому каналі качається до кінця.
+    """
+    base = session.timeout
+    return aiohttp.ClientTimeout(
+        total=None,
+        connect=base.connect,
+        sock_connect=base.sock_connect,
+        sock_read=seconds or _idle_timeout(),
+    )
+
+
+def _get(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: Optional[dict],
+    timeout: Optional[aiohttp.ClientTimeout],
+):
+    # timeout=None для aiohttp означає "без тайм-аутів", тому не передаємо його
+    if timeout is None:
+        return session.get(url, headers=headers)
+    return session.get(url, headers=headers, timeout=timeout)
+
+
+# --- ДОКАЧУВАННЯ (.part + sidecar) ---
+def _read_sidecar(part_path: str) -> Optional[dict]:
+    try:
+        with open(part_path + ".json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_sidecar(
+    part_path: str, url: str, validator: Optional[str], done, **extra
+):
+    with open(part_path + ".json", "w", encoding="utf-8") as f:
+        json.dump({"url": url, "validator": validator, "bytes": done, **extra}, f)
+
+
+def _remove_partial(part_path: str):
+    for p in (part_path, part_path + ".json"):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+# --- ПОТОКОВЕ ЗАВАНТАЖЕННЯ ---
+async def fetch_to_file(
+    session: aiohttp.ClientSession,
+    url: str,
+    path: str,
+    headers: Optional[dict] = None,
+    chunk_size: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+) -> int:
+    """
+    Качає url у path шматками, не тримаючи файл у пам'яті.
+
+    Поки файл не докачаний, він лежить як path.part з sidecar-файлом
+    (URL, ETag/Last-Modified, байти). Повторний виклик докачує його через
+    Range + If-Range; якщо файл на сервері змінився — починає з нуля.
+    При перевищенні max_bytes видаляє файл і кидає FileTooLarge.
+    """
+    chunk_size = chunk_size or _chunk_size()
+    max_bytes = max_bytes or _max_file_bytes()
+    part_path = path + ".part"
+
+    request_headers = dict(headers or {})
+    offset = 0
+    sidecar = _read_sidecar(part_path)
+    if sidecar and sidecar.get("validator") and os.path.exists(part_path):
+        # Без ETag/Last-Modified не можна гарантувати, що це той самий файл
+        offset = os.path.getsize(part_path)
+        request_headers["Range"] = f"bytes={offset}-"
+        request_headers["If-Range"] = sidecar["validator"]
+
+    async with _get(session, url, request_headers, timeout) as resp:
+        if resp.status == 416 and offset:
+            # .part вже повний або зіпсований — починаємо спочатку
+            _remove_partial(part_path)
+            return await fetch_to_file(
+                session, url, path, headers, chunk_size, max_bytes, timeout
+            )
+        resp.raise_for_status()
+        if resp.status != 206:
+            offset = 0
+        elif offset:
+            _stats["resumed"] += 1
+        if resp.content_length and offset + resp.content_length > max_bytes:
+            _stats["rejected"] += 1
+            _remove_partial(part_path)
+            raise FileTooLarge(f"{offset + resp.content_length} bytes > {max_bytes}")
+
+        validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+        _write_sidecar(part_path, url, validator, offset)
+
+        written = offset
+        try:
+            with open(part_path, "ab" if offset else "wb") as f:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise FileTooLarge(f"more than {max_bytes} bytes")
+                    f.write(chunk)
+        except FileTooLarge:
+            _stats["rejected"] += 1
+            _remove_partial(part_path)
+            raise
+        except BaseException:
+            # Лишаємо .part для наступної спроби
+            _write_sidecar(part_path, url, validator, written)
+            raise
+
+    os.replace(part_path, path)
+    os.remove(part_path + ".json")
+    _stats["files"] += 1
+    _stats["bytes"] += written - offset
+    return written
+
+
+# --- БАГАТОПОТОКОВЕ ЗАВАНТАЖЕННЯ (RANGE) ---
+class _RangeRefused(Exception):
+    """Сервер не віддав Range (200 замість 206) — діапазонами качати не вийде."""
+
+
+async def _probe_range(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: Optional[dict] = None,
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+) -> Tuple[Optional[int], Optional[str]]:
+    probe_headers = {**(headers or {}), "Range": "bytes=0-0"}
+    async with _get(session, url, probe_headers, timeout) as resp:
+        if resp.status != 206:
+            return None, None
+        # Content-Range: bytes 0-0/12345
+        content_range = resp.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+        return (int(total) if total.isdigit() else None), validator
+
+
+async def probe_range_support(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: Optional[dict] = None,
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+) -> Optional[int]:
+    """Розмір файлу, якщо сервер віддає Range-запити, інакше None."""
+    total, _ = await _probe_range(session, url, headers, timeout)
+    return total
+
+
+async def _fetch_segment(
+    session: aiohttp.ClientSession,
+    url: str,
+    path: str,
+    bounds: Tuple[int, int],
+    progress: List[int],
+    index: int,
+    headers: Optional[dict],
+    chunk_size: int,
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+    retries: int = 2,
+) -> int:
+    """
+    Качає сегмент bounds у path, продовжуючи з progress[index] байтів.
+    progress[index] оновлюється після кожного шматка; повертає його.
+    """
+    start, end = bounds
+    size = end - start + 1
+    for attempt in range(retries + 1):
+        done = progress[index]
+        if done == size:
+            return done
+        range_headers = {**(headers or {}), "Range": f"bytes={start + done}-{end}"}
+        try:
+            async with _get(session, url, range_headers, timeout) as resp:
+                # 5xx/429 — тимчасовий збій, а не відмова від Range
+                resp.raise_for_status()
+                if resp.status != 206:
+                    raise _RangeRefused(f"Range not honoured: HTTP {resp.status}")
+                with open(path, "r+b") as f:
+                    f.seek(start + done)
+                    async for chunk in resp.content.iter_chunked(chunk_size):
+                        if done + len(chunk) > size:
+                            raise aiohttp.ClientPayloadError(
+                                f"Segment {start}-{end}: more than {size} bytes"
+                            )
+                        f.write(chunk)
+                        done += len(chunk)
+                        progress[index] = done
+            if done != size:
+                raise aiohttp.ClientPayloadError(
+                    f"Segment {start}-{end}: got {done} bytes"
+                )
+            return done
+        except Exception as e:
+            if attempt < retries and _is_transient(e):
+                _stats["retries"] += 1
+                await asyncio.sleep(0.5 * 2**attempt)
+                continue
+            raise
+    return progress[index]
+
+
+async def _stop_segments(tasks: List[asyncio.Future]):
+    """Скасовує сегменти, що ще качаються, і чекає, поки вони закриють файл."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _resume_ranged(
+    ranged_path: str, url: str, validator: Optional[str], total: int
+) -> Optional[Tuple[List[Tuple[int, int]], List[int]]]:
+    """(межі сегментів, байти в кожному) з попередньої спроби або None."""
+    sidecar = _read_sidecar(ranged_path)
+    if (
+        not validator
+        or not sidecar
+        or sidecar.get("url") != url
+        or sidecar.get("validator") != validator
+        or sidecar.get("total") != total
+        or not os.path.exists(ranged_path)
+        or os.path.getsize(ranged_path) != total
+    ):
+        return None
+    bounds = [tuple(b) for b in sidecar.get("bounds") or []]
+    progress = sidecar.get("bytes")
+    if not bounds or not isinstance(progress, list) or len(progress) != len(bounds):
+        return None
+    return bounds, progress
+
+
+async def fetch_ranged(
+    session: aiohttp.ClientSession,
+    url: str,
+    path: str,
+    headers: Optional[dict] = None,
+    segments: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+) -> int:
+    """
+    Качає файл кількома Range-запитами паралельно в заздалегідь виділений
+    path.ranged. Якщо сервер не підтримує Range або файл малий — звичайний потік.
+
+    Поруч лежить sidecar з межами сегментів і байтами в кожному. Після
+    тимчасового збою (мережа, 5xx) він лишається, і наступний виклик
+    докачує лише те, чого бракує, — якщо ETag/Last-Modified не змінився.
+    """
+    segments = segments or _segments()
+    chunk_size = chunk_size or _chunk_size()
+    max_bytes = max_bytes or _max_file_bytes()
+    ranged_path = path + ".ranged"
+
+    def single_stream():
+        _remove_partial(ranged_path)
+        return fetch_to_file(
+            session,
+            url,
+            path,
+            headers=headers,
+            chunk_size=chunk_size,
+            max_bytes=max_bytes,
+            timeout=timeout,
+        )
+
+    if segments < 2 or os.path.exists(path + ".part"):
+        # Є недокачаний .part — докачуємо його одним потоком
+        return await single_stream()
+    total, validator = await _probe_range(session, url, headers, timeout)
+    if not total or total < _ranged_min_bytes():
+        return await single_stream()
+    if total > max_bytes:
+        _stats["rejected"] += 1
+        _remove_partial(ranged_path)
+        raise FileTooLarge(f"{total} bytes > {max_bytes}")
+
+    resumed = _resume_ranged(ranged_path, url, validator, total)
+    if resumed:
+        bounds, progress = resumed
+        _stats["resumed"] += 1
+    else:
+        with open(ranged_path, "wb") as f:
+            f.truncate(total)
+        part = -(-total // segments)
+        bounds = [(i, min(i + part, total) - 1) for i in range(0, total, part)]
+        progress = [0] * len(bounds)
+
+    def save_progress():
+        _write_sidecar(
+            ranged_path, url, validator, progress, total=total, bounds=bounds
+        )
+
+    segment_headers = dict(headers or {})
+    if validator:
+        # Файл на сервері змінився — отримаємо 200 і підемо одним потоком
+        segment_headers["If-Range"] = validator
+    tasks = [
+        asyncio.ensure_future(
+            _fetch_segment(
+                session,
+                url,
+                ranged_path,
+                segment,
+                progress,
+                index,
+                segment_headers,
+                chunk_size,
+                timeout,
+            )
+        )
+        for index, segment in enumerate(bounds)
+    ]
+    try:
+        written = sum(await asyncio.gather(*tasks))
+    except Exception as e:
+        # Решта сегментів не має писати у файл, поки вирішуємо, що далі
+        await _stop_segments(tasks)
+        if validator and _is_transient(e):
+            # Лишаємо path.ranged: наступна спроба докачає сегменти
+            save_progress()
+            raise
+        # CDN передумав віддавати Range — качаємо одним потоком
+        print(f"Ranged download failed, falling back to single stream: {e}")
+        return await single_stream()
+    except BaseException:
+        await _stop_segments(tasks)
+        if validator:
+            save_progress()
+        else:
+            _remove_partial(ranged_path)
+        raise
+
+    if written != total:
+        # Розмір файлу після truncate завжди total, тож рахуємо самі байти
+        print(f"Ranged download size mismatch: {written} != {total}")
+        return await single_stream()
+
+    os.replace(ranged_path, path)
+    _remove_partial(ranged_path)
+    _stats["files"] += 1
+    _stats["bytes"] += total
+    _stats["ranged"] += 1
+    return total
+
+
+def _is_transient(e: BaseException) -> bool:
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500 or e.status == 429
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+# --- ПОВТОРИ З ДОКАЧУВАННЯМ ---
+async def fetch_with_retries(
+    session: aiohttp.ClientSession,
+    url: str,
+    path: str,
+    headers: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    ranged: bool = False,
+) -> int:
+    """
+    Качає url у path, повторюючи тимчасові збої (мережа, 5xx, 429).
+    .part / .ranged між спробами не видаляються, тож кожна наступна
+    спроба докачує файл, а не починає заново. Після останньої невдалої
+    спроби кидає її виняток.
+    timeout — секунди тиші на з'єднанні, після яких спроба обривається;
+    загальний час завантаження не обмежений.
+    ranged=True — великі файли качаються через fetch_ranged.
+    """
+    fetch = fetch_ranged if ranged and _segments() > 1 else fetch_to_file
+    request_timeout = idle_timeout(session, timeout)
+    retries = _item_retries() if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return await fetch(
+                session, url, path, headers=headers, timeout=request_timeout
+            )
+        except Exception as e:
+            if attempt < retries and _is_transient(e):
+                _stats["retries"] += 1
+                await asyncio.sleep(0.5 * 2**attempt)
+                continue
+            raise
+
+
+# --- ПАРАЛЕЛЬНЕ ЗАВАНТАЖЕННЯ КАРУСЕЛЕЙ ---
+async def fetch_many(
+    session: aiohttp.ClientSession,
+    items: List[Tuple[str, str]],
+    headers: Optional[dict] = None,
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    ranged: bool = False,
+) -> List[Optional[str]]:
+    """
+    Качає (url, path) паралельно через fetch_with_retries, не більше
+    concurrency одночасно. Результат у тому ж порядку, що й items: path
+    або None, якщо не вдалося.
+    Завеликий файл пропускається; якщо не скачався жоден, а хоча б один
+    був завеликим — кидає FileTooLarge.
+    """
+    semaphore = asyncio.Semaphore(concurrency or _concurrency())
+    too_large: List[FileTooLarge] = []
+
+    async def fetch_one(url: str, path: str) -> Optional[str]:
+        async with semaphore:
+            try:
+                await fetch_with_retries(
+                    session,
+                    url,
+                    path,
+                    headers=headers,
+                    timeout=timeout,
+                    retries=retries,
+                    ranged=ranged,
+                )
+                return path
+            except FileTooLarge as e:
+                print(f"Item too large, skipped: {e}")
+                too_large.append(e)
+                return None
+            except Exception as e:
+                print(f"Error downloading specific item: {e}")
+                return None
+
+    paths = await asyncio.gather(*(fetch_one(url, path) for url, path in items))
+    if too_large and not any(paths):
+        raise too_large[0]
+    return paths
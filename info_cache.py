@@ -0,0 +1,106 @@
+# info_cache.py
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import yt_dlp
+
+# googlevideo: ...&expire=1700000000&... або .../expire/1700000000/...;
+# CloudFront та інші CDN: Expires=1700000000
+_EXPIRE_RE = re.compile(r"(?:[?&]|/)expires?[=/](\d{9,11})", re.IGNORECASE)
+
+
+def signed_url_expiry(info: dict) -> Optional[float]:
+    """Найраніший час, коли протухне хоч одне підписане посилання на формат."""
+    stamps = []
+    for fmt in info.get("formats") or [info]:
+        for key in ("url", "manifest_url", "fragment_base_url"):
+            match = _EXPIRE_RE.search(fmt.get(key) or "")
+            if match:
+                stamps.append(float(match.group(1)))
+    return min(stamps) if stamps else None
+
+
+# --- КЕШ INFO-DICT ---
+class InfoCache:
+    """
+    Кеш результатів extract_info(download=False) для повторного
+    process_ie_result без повторного парсингу сторінки.
+
+    Запис живе не довше ttl і не довше, ніж підписані посилання форматів
+    (мінус margin — запас на початок завантаження). Потокобезпечний:
+    ним користуються і event loop бота, і потоки yt-dlp.
+    """
+
+    def __init__(self, max_entries: int = 32, ttl: float = 1800, margin: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.margin = margin
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            info, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return info
+
+    def put(self, key: str, info: dict):
+        expires_at = time.time() + self.ttl
+        url_expiry = signed_url_expiry(info)
+        if url_expiry is not None:
+            expires_at = min(expires_at, url_expiry - self.margin)
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (info, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+            }
+
+
+def extract_info(url: str) -> dict:
+    """extract_info(download=False) у вигляді, придатному для кешу і pickle."""
+    opts = {"quiet": True, "no_warnings": True, "allow_playlist": False}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    # Без приватних ключів (requested_formats, filepath...) — як --load-info-json
+    return yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+
+
+def extract_info_cached(cache: InfoCache, url: str, key: Optional[str] = None) -> dict:
+    """extract_info(download=False) через кеш; key — за замовчуванням сам URL."""
+    key = key or url
+    info = cache.get(key)
+    if info is None:
+        info = extract_info(url)
+        cache.put(key, info)
+    return info
@@ -0,0 +1,173 @@
+# instagram_pool.py
+import asyncio
+import os
+import pickle
+import threading
+from typing import Callable, List, Optional
+
+import instaloader
+from instaloader.exceptions import (
+    BadResponseException,
+    ConnectionException,
+    LoginException,
+    LoginRequiredException,
+    PrivateProfileNotFollowedException,
+    ProfileNotExistsException,
+    QueryReturnedForbiddenException,
+    QueryReturnedNotFoundException,
+)
+from instaloader.instaloader import (
+    get_default_session_filename,
+    get_legacy_session_filename,
+)
+
+
+def is_auth_error(e: Exception) -> bool:
+    """Сесія протухла або Instagram вимагає логін — контекст треба перезібрати."""
+    if isinstance(
+        e, (LoginRequiredException, LoginException, QueryReturnedForbiddenException)
+    ):
+        return True
+    if isinstance(e, ConnectionException):
+        text = str(e).lower()
+        return "401" in text or "login" in text
+    return False
+
+
+def is_missing_content(e: Exception) -> bool:
+    """Пост видалений, приватний або посилання хибне — бекенд тут ні до чого."""
+    # BadResponseException — "Fetching Post metadata failed" для недоступних постів
+    return isinstance(
+        e,
+        (
+            BadResponseException,
+            PrivateProfileNotFollowedException,
+            ProfileNotExistsException,
+            QueryReturnedNotFoundException,
+        ),
+    )
+
+
+# --- ПУЛ КОНТЕКСТІВ INSTALOADER ---
+class InstaloaderPool:
+    """
+    Пул готових Instaloader з уже завантаженою сесією.
+
+    Файл сесії читається один раз, кожен контекст тримає свою
+    requests.Session з keep-alive з'єднаннями і повертається в пул після
+    задачі. Одночасно працює не більше size контекстів. Помилка авторизації
+    перечитує файл сесії, відкидає всі старі контексти і повторює задачу
+    один раз на свіжому.
+    """
+
+    def __init__(self, username: str, user_agent: str, size: int):
+        self.username = username
+        self.user_agent = user_agent
+        self.size = max(1, size)
+        self.stats = {"created": 0, "reused": 0, "refreshed": 0, "auth_errors": 0}
+        self._lock = threading.Lock()
+        self._idle: List[tuple] = []
+        self._generation = 0
+        self._session_data: Optional[dict] = None
+        self._session_loaded = False
+        self._slots = asyncio.Semaphore(self.size)
+
+    def _load_session_data(self) -> Optional[dict]:
+        filename = get_default_session_filename(self.username)
+        if not os.path.exists(filename):
+            filename = get_legacy_session_filename(self.username)
+        try:
+            with open(filename, "rb") as f:
+                data = pickle.load(f)
+            print("DEBUG: Session loaded successfully")
+            return data
+        except FileNotFoundError:
+            print("DEBUG: Session file not found, trying without session")
+        except Exception as e:
+            print(f"DEBUG: Session load error: {e}")
+        return None
+
+    def _create(self, generation: int) -> tuple:
+        with self._lock:
+            if not self._session_loaded:
+                self._session_data = self._load_session_data()
+                self._session_loaded = True
+            session_data = self._session_data
+        loader = instaloader.Instaloader(
+            download_pictures=True,
+            download_videos=True,
+            save_metadata=False,
+            compress_json=False,
+            # Додаємо User-Agent, щоб Інста менше блокувала
+            user_agent=self.user_agent,
+        )
+        if session_data:
+            loader.load_session(self.username, session_data)
+        self.stats["created"] += 1
+        return generation, loader
+
+    def _acquire(self) -> tuple:
+        with self._lock:
+            # Останній повернений — з найсвіжішими з'єднаннями
+            while self._idle:
+                generation, loader = self._idle.pop()
+                if generation == self._generation:
+                    self.stats["reused"] += 1
+                    return generation, loader
+                loader.close()
+            generation = self._generation
+        return self._create(generation)
+
+    def _release(self, entry: tuple):
+        generation, loader = entry
+        with self._lock:
+            if generation == self._generation:
+                self._idle.append(entry)
+                return
+        loader.close()
+
+    def _refresh(self, generation: int):
+        with self._lock:
+            # Кілька задач могли впасти одночасно — перечитуємо сесію один раз
+            if generation != self._generation:
+                return
+            self._generation += 1
+            self._session_loaded = False
+            stale, self._idle = self._idle, []
+            self.stats["refreshed"] += 1
+        for _, loader in stale:
+            loader.close()
+
+    def _run_sync(self, func: Callable):
+        for attempt in range(2):
+            entry = self._acquire()
+            try:
+                result = func(entry[1])
+            except Exception as e:
+                if not is_auth_error(e):
+                    self._release(entry)
+                    raise
+                self.stats["auth_errors"] += 1
+                entry[1].close()
+                self._refresh(entry[0])
+                if attempt:
+                    raise
+                print(f"DEBUG: Instagram auth error, refreshing session: {e}")
+                continue
+            self._release(entry)
+            return result
+
+    async def run(self, func: Callable):
+        """Виконує func(loader) в потоці на контексті з пулу."""
+        async with self._slots:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self._run_sync, func)
+
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def close(self):
+        with self._lock:
+            stale, self._idle = self._idle, []
+        for _, loader in stale:
+            loader.close()
@@ -0,0 +1,114 @@
+# job_store.py
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+
+# --- ПОСТІЙНА ЧЕРГА ЗАВАНТАЖЕНЬ ---
+class JobStore:
+    """
+    Зберігає завантаження в SQLite, щоб після перезапуску бота
+    незавершені job продовжились, а не загубились.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                chat_type TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                user_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                audio_only INTEGER NOT NULL,
+                max_height INTEGER,
+                session_dir TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def create(
+        self,
+        chat_id: int,
+        chat_type: str,
+        message_id: int,
+        user_id: int,
+        url: str,
+        audio_only: bool,
+        max_height: Optional[int],
+        session_dir: str,
+    ) -> int:
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO jobs (chat_id, chat_type, message_id, user_id, url, "
+                "audio_only, max_height, session_dir, status, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    chat_id,
+                    chat_type,
+                    message_id,
+                    user_id,
+                    url,
+                    int(audio_only),
+                    max_height,
+                    session_dir,
+                    STATUS_PENDING,
+                    now,
+                    now,
+                ),
+            )
+            return cur.lastrowid
+
+    def set_status(self, job_id: int, status: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                (status, time.time(), job_id),
+            )
+
+    def set_status_message(self, job_id: int, status_message_id: int):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status_message_id = ?, updated = ? WHERE id = ?",
+                (status_message_id, time.time(), job_id),
+            )
+
+    def unfinished(self) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY id",
+                (STATUS_PENDING, STATUS_RUNNING),
+            ).fetchall()
+
+    def prune(self, older_than: float):
+        """Видаляє завершені job, старші за older_than секунд."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated < ?",
+                (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED, time.time() - older_than),
+            )
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
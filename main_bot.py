@@ -4,8 +4,9 @@ import logging
 import os
 import re
 import shutil
+from datetime import datetime
 from functools import wraps
-from typing import Optional
+from typing import Dict, List, Optional
 
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.client.session.aiohttp import AiohttpSession
@@ -23,7 +24,50 @@ from aiogram.types import (
 )
 from dotenv import load_dotenv
 
-from downloader_lib import download_media
+from downloader_lib import (
+    audio_variant,
+    canonicalize_url,
+    describe_qualities,
+    detect_backend,
+    download_media,
+    get_failure_store,
+    get_info_cache,
+    get_media_cache,
+    get_resilience,
+    get_ytdlp_pool,
+    in_flight_count,
+    instagram_pool_stats,
+    is_cached,
+    is_in_flight,
+    new_session_dir,
+    prefetch_info,
+    probe_download,
+    reap_session_dirs,
+    register_extra_sites,
+    registry,
+    resolve_backend,
+    shutdown_instagram_pool,
+    shutdown_ytdlp_pool,
+)
+from file_id_cache import FileIdCache, SentItem
+from http_fetch import FileTooLarge, HttpClient, fetch_stats
+from job_store import (
+    STATUS_CANCELLED,
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_RUNNING,
+    JobStore,
+)
+from media_file import KIND_AUDIO, KIND_DOCUMENT, KIND_PHOTO, KIND_VIDEO, MediaFile
+from postprocess import postprocess_stats, shutdown_postprocess_pool
+from progress_dispatcher import ProgressDispatcher
+from scheduler import (
+    PRIORITY_LARGE,
+    PRIORITY_NORMAL,
+    PRIORITY_SMALL,
+    JobScheduler,
+    parse_backend_limits,
+)
 
 load_dotenv()
 
@@ -37,17 +81,47 @@ ALLOWED_IDS_STR = os.getenv("ALLOWED_USER_IDS", "")
 ALLOWED_USER_IDS = {int(uid) for uid in ALLOWED_IDS_STR.split(",") if uid.strip()}
 
 LOCAL_API_URL = os.getenv("LOCAL_API_URL")
-
-session = None
-if LOCAL_API_URL:
-    print(f"🔌 Використовується локальний Bot API сервер: {LOCAL_API_URL}")
-    session = AiohttpSession(
-        api=TelegramAPIServer.from_base(LOCAL_API_URL),
-        timeout=7200,  # 2 години таймаут
-    )
+BOT_DB_PATH = os.getenv("BOT_DB_PATH", "bot_data.db")
+# Глобальний бюджет редагувань статус-повідомлень
+PROGRESS_EDITS_PER_SEC = float(os.getenv("PROGRESS_EDITS_PER_SEC", "5"))
+# Скільки тримати завершені job в базі
+JOB_HISTORY_TTL = 7 * 24 * 3600
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "4"))
+# Відео, оцінене до цього розміру, йде в чергу як дрібне
+SMALL_JOB_BYTES = int(os.getenv("SMALL_JOB_MB", "50")) * 1024 * 1024
 
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+http_client = HttpClient.from_env()
+progress = ProgressDispatcher(PROGRESS_EDITS_PER_SEC)
+
+# Створюються в setup(): пули з spawn імпортують цей модуль у кожному
+# воркері як __mp_main__, і там не потрібні ні SQLite, ні реєстрація сайтів
+session: Optional[AiohttpSession] = None
+file_id_cache: Optional[FileIdCache] = None
+job_store: Optional[JobStore] = None
+scheduler: Optional[JobScheduler] = None
+
+
+def setup():
+    global session, file_id_cache, job_store, scheduler
+    register_extra_sites()
+    # Ліміти, оголошені бекендами, з перевизначеннями з BACKEND_LIMITS
+    backend_limits = {
+        **registry.default_limits(),
+        **parse_backend_limits(os.getenv("BACKEND_LIMITS", "")),
+    }
+
+    if LOCAL_API_URL:
+        print(f"🔌 Використовується локальний Bot API сервер: {LOCAL_API_URL}")
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(LOCAL_API_URL),
+            timeout=7200,  # 2 години таймаут
+        )
+
+    file_id_cache = FileIdCache(BOT_DB_PATH)
+    job_store = JobStore(BOT_DB_PATH)
+    scheduler = JobScheduler(MAX_CONCURRENT_JOBS, backend_limits)
 
 
 # --- ДЕКОРАТОР ---
@@ -69,28 +143,81 @@ def allowed_users_only(func):
 
 
 # --- КЛАВІАТУРА ---
-def get_quality_keyboard():
-    buttons = [
-        [
-            InlineKeyboardButton(
-                text="💎 Найкраща (1080p+)", callback_data="qual_best"
-            ),
-            InlineKeyboardButton(text="ᴴᴰ 720p", callback_data="qual_720"),
-        ],
-        [
-            InlineKeyboardButton(text="📺 480p", callback_data="qual_480"),
-            InlineKeyboardButton(text="📱 360p", callback_data="qual_360"),
-        ],
-        [
-            InlineKeyboardButton(
-                text="🎵 Тільки аудіо (MP3)", callback_data="qual_audio"
-            )
-        ],
-        [InlineKeyboardButton(text="❌ Скасувати", callback_data="qual_cancel")],
+def _size_label(size: Optional[int]) -> str:
+    if not size:
+        return ""
+    mb = size / 1024 / 1024
+    return f" · ~{mb / 1024:.1f} GB" if mb >= 1024 else f" · ~{mb:.0f} MB"
+
+
+def get_quality_keyboard(qualities: Optional[dict] = None, audio: bool = True):
+    """
+    qualities — результат describe_qualities: тоді кнопки показують
+    розміри, а висот, яких у відео немає, не показуємо.
+    audio — чи має бекенд режим "тільки аудіо".
+    """
+    video_options = [
+        (None, "💎 Найкраща (1080p+)", "qual_best"),
+        (720, "ᴴᴰ 720p", "qual_720"),
+        (480, "📺 480p", "qual_480"),
+        (360, "📱 360p", "qual_360"),
     ]
+    video_buttons = []
+    for height, text, data in video_options:
+        if qualities is not None:
+            if height not in qualities["sizes"]:
+                continue
+            if height is None and qualities["top_height"]:
+                text = f"💎 Найкраща ({qualities['top_height']}p)"
+            text += _size_label(qualities["sizes"][height])
+        video_buttons.append(InlineKeyboardButton(text=text, callback_data=data))
+
+    audio_text = "🎵 Тільки аудіо"
+    if qualities is not None:
+        audio_text += _size_label(qualities["audio"])
+    buttons = [video_buttons[i : i + 2] for i in range(0, len(video_buttons), 2)]
+    if audio:
+        buttons.append(
+            [InlineKeyboardButton(text=audio_text, callback_data="qual_audio")]
+        )
+    buttons.append(
+        [InlineKeyboardButton(text="❌ Скасувати", callback_data="qual_cancel")]
+    )
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def get_cancel_keyboard(job_id: int):
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Скасувати", callback_data=f"cancel_{job_id}")]
+        ]
+    )
+
+
+# Клавіатури, які ще чекають на розміри (chat_id, message_id)
+_open_keyboards = set()
+_keyboard_tasks = set()
+
+
+async def _refine_quality_keyboard(
+    keyboard_msg: types.Message, url: str, audio: bool = True
+):
+    """Коли фоновий extract_info готовий — підставляє розміри в клавіатуру."""
+    key = (keyboard_msg.chat.id, keyboard_msg.message_id)
+    _open_keyboards.add(key)
+    try:
+        qualities = await describe_qualities(url)
+        # Користувач уже обрав якість — клавіатуру не повертаємо
+        if key in _open_keyboards:
+            await keyboard_msg.edit_reply_markup(
+                reply_markup=get_quality_keyboard(qualities, audio)
+            )
+    except Exception as e:
+        logging.debug(f"Could not refine quality keyboard: {e}")
+    finally:
+        _open_keyboards.discard(key)
+
+
 # --- ДОПОМІЖНІ ---
 def extract_url(text: str) -> Optional[str]:
     match = re.search(r"(https?://[^\s]+)", text)
@@ -103,7 +230,108 @@ def extract_url(text: str) -> Optional[str]:
 @dp.message(CommandStart())
 @allowed_users_only
 async def send_welcome(message: types.Message):
-    await message.reply("Привіт! Надішли посилання.\n\nКоманди:\n/clean - очистити кеш")
+    await message.reply(
+        "Привіт! Надішли посилання.\n\nКоманди:\n/clean - очистити кеш\n/stats - статистика"
+    )
+
+
+# --- КОМАНДА STATS ---
+@dp.message(Command("stats"))
+@allowed_users_only
+async def handle_stats(message: types.Message):
+    cache = get_media_cache().stats()
+    ids = file_id_cache.stats()
+    queue = scheduler.stats()
+    jobs = job_store.counts()
+    fetch = fetch_stats()
+    pool = http_client.stats()
+    edits = progress.stats
+    post = postprocess_stats()
+    infos = get_info_cache().stats()
+
+    lines = [
+        "📊 *Кеш файлів*",
+        f"Записів: `{cache['entries']}` ({cache['size_bytes'] / 1024 / 1024:.1f} MB)",
+        f"Влучань: `{cache['hits']}` / Промахів: `{cache['misses']}`",
+        f"Витіснено: `{cache['evictions']}` / Прострочено: `{cache['expired']}`",
+        "",
+        "📎 *Кеш file\\_id*",
+        f"Записів: `{ids['entries']}`",
+        f"Влучань: `{ids['hits']}` / Промахів: `{ids['misses']}`",
+        "",
+        "🧾 *Кеш метаданих yt-dlp*",
+        f"Записів: `{infos['entries']}`, влучань: `{infos['hits']}`, "
+        f"промахів: `{infos['misses']}`, прострочено: `{infos['expired']}`",
+        "",
+        "⏳ *Черга*",
+        f"Активних завантажень: `{in_flight_count()}`",
+        f"Виконується: `{queue['running']}/{queue['global_limit']}`, "
+        f"очікує: `{queue['pending']}`",
+    ]
+    for name, (running, limit) in queue["backends"].items():
+        lines.append(f"  • {name}: `{running}/{limit}`")
+    ytdlp = get_ytdlp_pool()
+    lines.append(
+        f"Процеси yt-dlp: `{ytdlp.workers()}/{ytdlp.size}`, задач: `{ytdlp.stats['jobs']}`, "
+        f"таймаутів: `{ytdlp.stats['timeouts']}`, вбито: `{ytdlp.stats['killed']}`, "
+        f"перезапущено: `{ytdlp.stats['recycled']}`"
+    )
+    resilience = get_resilience().stats()
+    if resilience["backends"]:
+        lines.append(f"Запобіжники бекендів (повторів: `{resilience['retried']}`):")
+        for name, b in resilience["backends"].items():
+            lines.append(
+                f"  • {name}: `{b['state']}`, помилок `{b['error_rate']:.0%}` "
+                f"з `{b['calls']}`, спрацював: `{b['opened']}`, відхилено: `{b['rejected']}`"
+            )
+    insta = instagram_pool_stats()
+    if insta:
+        lines.append(
+            f"Контексти Instagram: `{insta['idle']}` вільних (макс. `{insta['size']}`), "
+            f"створено: `{insta['created']}`, повторно: `{insta['reused']}`, "
+            f"оновлень сесії: `{insta['refreshed']}`"
+        )
+    lines.append(
+        "Job в базі: "
+        + (", ".join(f"{status} `{count}`" for status, count in jobs.items()) or "—")
+    )
+    lines += [
+        "",
+        "🌐 *Прямі завантаження*",
+        f"Файлів: `{fetch['files']}` ({fetch['bytes'] / 1024 / 1024:.1f} MB), "
+        f"відхилено: `{fetch['rejected']}`, повторів: `{fetch['retries']}`, "
+        f"багатопотокових: `{fetch['ranged']}`, докачано: `{fetch['resumed']}`",
+    ]
+    if fetch["peak_rss_mb"] is not None:
+        lines.append(f"Пік пам'яті процесу: `{fetch['peak_rss_mb']:.0f} MB`")
+    lines += [
+        f"Пул з'єднань: `{pool['active']}/{pool['limit']}` "
+        f"(на хост `{pool['limit_per_host']}`)",
+        f"Запитів: `{pool['requests']}`, нових з'єднань: `{pool['new_connections']}`, "
+        f"повторно: `{pool['reused_connections']}`",
+        f"DNS кеш: `{pool['dns_hits']}` влучань / `{pool['dns_misses']}` промахів",
+        "",
+        "✏️ *Оновлення прогресу*",
+        f"Надіслано: `{edits['sent']}` з `{edits['submitted']}`, "
+        f"склеєно: `{edits['coalesced']}`, відкинуто: `{edits['dropped']}`",
+        f"429 від Telegram: `{edits['retry_after']}`",
+    ]
+    failures = get_failure_store().stats()
+    if failures["entries"]:
+        lines += [
+            "",
+            "🧪 *Знімки збоїв*",
+            f"Знімків: `{failures['entries']}` "
+            f"({failures['size_bytes'] / 1024 / 1024:.1f} MB), "
+            f"ротовано: `{failures['rotated']}`",
+        ]
+    if post["jobs"]:
+        lines += ["", f"🎨 *Обробка аудіо* (`{post['jobs']}` файлів)"]
+        lines += [
+            f"  • {step}: `{count}` раз, в середньому `{sec * 1000:.0f} ms`"
+            for step, (count, sec) in post["steps"].items()
+        ]
+    await message.reply("\n".join(lines), parse_mode="Markdown")
 
 
 # --- КОМАНДА CLEAN ---
@@ -118,9 +346,13 @@ async def handle_clean(message: types.Message):
 
     deleted_files = 0
     deleted_folders = 0
+    # Знімки збоїв — фікстури для парсерів, їх /clean не чіпає
+    keep = {os.path.normpath(get_failure_store().root)}
     try:
         for filename in os.listdir(base_dir):
             file_path = os.path.join(base_dir, filename)
+            if os.path.normpath(file_path) in keep:
+                continue
             try:
                 if os.path.isfile(file_path) or os.path.islink(file_path):
                     os.unlink(file_path)
@@ -130,6 +362,7 @@ async def handle_clean(message: types.Message):
                     deleted_folders += 1
             except Exception as e:
                 logging.debug(f"Could not remove {file_path}: {e}")
+        get_media_cache().forget_all()
         await status_msg.edit_text(
             f"✅ Очищено.\nПапок: {deleted_folders}\nФайлів: {deleted_files}"
         )
@@ -137,10 +370,31 @@ async def handle_clean(message: types.Message):
         await status_msg.edit_text(f"❌ Помилка: {e}")
 
 
+# --- СКАСУВАННЯ JOB ---
+# job_id -> задача process_download
+_active_jobs: Dict[int, asyncio.Task] = {}
+_cancel_requested = set()
+
+
+@dp.callback_query(F.data.startswith("cancel_"))
+@allowed_users_only
+async def handle_cancel(callback: types.CallbackQuery):
+    job_id = int(callback.data.split("_", 1)[1])
+    task = _active_jobs.get(job_id)
+    if task is None or task.done():
+        await callback.answer("Вже завершено")
+        return
+    # Скасування задачі звільняє слот у черзі і зупиняє бекенд
+    _cancel_requested.add(job_id)
+    task.cancel()
+    await callback.answer("🚫 Скасовую...")
+
+
 @dp.callback_query(F.data.startswith("qual_"))
 @allowed_users_only
 async def handle_quality_choice(callback: types.CallbackQuery, state: FSMContext):
     action = callback.data
+    _open_keyboards.discard((callback.message.chat.id, callback.message.message_id))
     if action == "qual_cancel":
         await callback.message.delete()
         await callback.answer("Скасовано")
@@ -151,6 +405,9 @@ async def handle_quality_choice(callback: types.CallbackQuery, state: FSMContext
 
     data = await state.get_data()
     url = data.get("url")
+    if not url and callback.message.reply_to_message:
+        # MemoryStorage очищується при перезапуску — беремо лінк з оригіналу
+        url = extract_url(callback.message.reply_to_message.text or "")
     if not url:
         await callback.message.edit_text("❌ Посилання втрачено.")
         return
@@ -165,7 +422,11 @@ async def handle_quality_choice(callback: types.CallbackQuery, state: FSMContext
         max_height = 360
 
     await process_download(
-        callback.message, url, audio_only=audio_only, max_height=max_height
+        callback.message,
+        url,
+        user_id=callback.from_user.id,
+        audio_only=audio_only,
+        max_height=max_height,
     )
 
 
@@ -176,56 +437,244 @@ async def handle_text(message: types.Message, state: FSMContext):
     if not url:
         return
 
-    is_music_service = any(
-        x in url
-        for x in [
-            "music.youtube.com",
-            "soundcloud.com",
-            "spotify.com",
-            "deezer.com",
-            "apple.com/music",
-        ]
-    )
-
-    if is_music_service:
-        await process_download(message, url, audio_only=True)
-    elif ("youtube.com" in url or "youtu.be" in url) and "shorts" not in url:
+    # Що запропонувати, вирішують можливості бекенда, а не списки доменів
+    backend = resolve_backend(url)
+    user_id = message.from_user.id
+    if backend and backend.is_audio_url(url):
+        await process_download(message, url, user_id=user_id, audio_only=True)
+    elif backend and backend.offers_quality(url):
         await state.update_data(url=url)
-        await message.reply(
-            "🎥 Виберіть якість відео:", reply_markup=get_quality_keyboard()
+        # Поки користувач обирає якість, метадані вже витягуються у фоні
+        prefetch_info(url)
+        keyboard_msg = await message.reply(
+            "🎥 Виберіть якість відео:",
+            reply_markup=get_quality_keyboard(audio=backend.audio),
         )
+        task = asyncio.create_task(
+            _refine_quality_keyboard(keyboard_msg, url, backend.audio)
+        )
+        _keyboard_tasks.add(task)
+        task.add_done_callback(_keyboard_tasks.discard)
     else:
-        # Instagram, TikTok etc
-        await process_download(message, url, audio_only=False)
+        # Instagram, TikTok, shorts, непідтримувані сервіси
+        await process_download(message, url, user_id=user_id, audio_only=False)
+
+
+# --- ВІДПРАВКА ---
+# sendAudio приймає лише MP3 і M4A; opus з AUDIO_MODE=native йде документом
+TELEGRAM_AUDIO_EXTS = (".mp3", ".m4a")
+
+
+def _sent_file_id(sent: types.Message) -> Optional[SentItem]:
+    if sent.audio:
+        return ("audio", sent.audio.file_id)
+    if sent.document:
+        return ("document", sent.document.file_id)
+    if sent.video:
+        return ("video", sent.video.file_id)
+    if sent.photo:
+        return ("photo", sent.photo[-1].file_id)
+    return None
+
+
+def _media_kwargs(media: Optional[MediaFile]) -> dict:
+    """Метадані від бекенда, щоб Telegram не визначав їх сам."""
+    if media is None:
+        return {}
+    duration = int(media.duration) if media.duration else None
+    if media.kind == KIND_AUDIO:
+        return {"duration": duration, "title": media.title, "performer": media.uploader}
+    if media.kind == KIND_VIDEO:
+        return {
+            "duration": duration,
+            "width": media.width,
+            "height": media.height,
+            "supports_streaming": True,
+        }
+    return {}
+
+
+async def _send_media(message: types.Message, items: list) -> List[SentItem]:
+    """
+    Надсилає список (kind, media, MediaFile або None), де media — FSInputFile
+    або file_id. Аудіо йде окремими повідомленнями, фото/відео — альбомами по 10.
+    Повертає file_id надісланого в тому ж порядку.
+    """
+    sent_items: List[SentItem] = []
+    media_group = []
+    for kind, media, details in items:
+        kwargs = _media_kwargs(details)
+        if (
+            kind == KIND_AUDIO
+            and details is not None
+            and not details.path.lower().endswith(TELEGRAM_AUDIO_EXTS)
+        ):
+            kind = KIND_DOCUMENT
+        if kind == KIND_AUDIO:
+            sent = await message.reply_audio(media, request_timeout=7200, **kwargs)
+            sent_items.append(_sent_file_id(sent))
+        elif kind == KIND_DOCUMENT:
+            sent = await message.reply_document(media, request_timeout=7200)
+            sent_items.append(_sent_file_id(sent))
+        elif kind == KIND_PHOTO:
+            media_group.append(InputMediaPhoto(media=media))
+        else:
+            media_group.append(InputMediaVideo(media=media, **kwargs))
+
+    if media_group:
+        if len(media_group) == 1:
+            item = media_group[0]
+            if isinstance(item, InputMediaPhoto):
+                sent = await message.reply_photo(item.media, request_timeout=7200)
+            else:
+                sent = await message.reply_video(
+                    item.media,
+                    duration=item.duration,
+                    width=item.width,
+                    height=item.height,
+                    supports_streaming=item.supports_streaming,
+                    request_timeout=7200,
+                )
+            sent_items.append(_sent_file_id(sent))
+        else:
+            for i in range(0, len(media_group), 10):
+                sent_group = await message.reply_media_group(
+                    media=media_group[i : i + 10], request_timeout=7200
+                )
+                sent_items.extend(_sent_file_id(sent) for sent in sent_group)
+
+    return [item for item in sent_items if item]
+
+
+def _job_priority(
+    url: str,
+    audio_only: bool,
+    max_height: Optional[int],
+    estimate: Optional[int] = None,
+) -> int:
+    backend = resolve_backend(url)
+    if audio_only or backend is None or not backend.offers_quality(url):
+        return PRIORITY_SMALL
+    if estimate is not None and estimate <= SMALL_JOB_BYTES:
+        return PRIORITY_SMALL
+    if max_height and max_height <= 720:
+        return PRIORITY_NORMAL
+    return PRIORITY_LARGE
 
 
 async def process_download(
     message: types.Message,
     url: str,
+    user_id: int,
     audio_only: bool = False,
     max_height: Optional[int] = None,
+    job_id: Optional[int] = None,
+    session_dir: Optional[str] = None,
 ):
-    status_msg = await message.answer("⏳ Підготовка...")
+    canonical_url = canonicalize_url(url)
+    variant = audio_variant(audio_only)
 
-    async def update_progress(text: str):
+    # Вже надсилали — відправляємо за file_id без завантаження
+    cached_ids = file_id_cache.get(canonical_url, audio_only, max_height, variant)
+    if cached_ids:
         try:
-            if status_msg.text != text:
-                await status_msg.edit_text(text, parse_mode="Markdown")
-        except TelegramBadRequest:
-            pass
-        except Exception as e:
-            print(f"Error: {e}")
+            await _send_media(message, [(kind, fid, None) for kind, fid in cached_ids])
+            if job_id:
+                job_store.set_status(job_id, STATUS_DONE)
+                if session_dir and os.path.exists(session_dir):
+                    shutil.rmtree(session_dir, ignore_errors=True)
+            return
+        except TelegramBadRequest as e:
+            logging.info(f"Cached file_id rejected, downloading again: {e}")
+            file_id_cache.delete(canonical_url, audio_only, max_height, variant)
+
+    if job_id is None:
+        session_dir = new_session_dir()
+        job_id = job_store.create(
+            chat_id=message.chat.id,
+            chat_type=message.chat.type,
+            message_id=message.message_id,
+            user_id=user_id,
+            url=url,
+            audio_only=audio_only,
+            max_height=max_height,
+            session_dir=session_dir,
+        )
 
-    download_dir = None
-    try:
-        file_paths = await download_media(
+    cancel_keyboard = get_cancel_keyboard(job_id)
+    status_msg = await message.answer("⏳ Підготовка...", reply_markup=cancel_keyboard)
+    job_store.set_status_message(job_id, status_msg.message_id)
+    _active_jobs[job_id] = asyncio.current_task()
+
+    async def update_progress(text: str):
+        # Не редагуємо напряму: диспетчер склеює часті оновлення
+        progress.submit(status_msg, text, reply_markup=cancel_keyboard)
+
+    async def report_position(position: int):
+        await update_progress(f"⏳ *У черзі:* позиція {position}")
+
+    download_height = max_height
+    # Після старту папкою сесії розпоряджається single-flight у downloader_lib
+    handed_off = False
+
+    async def run_download():
+        nonlocal handed_off
+        handed_off = True
+        job_store.set_status(job_id, STATUS_RUNNING)
+        return await download_media(
             url,
             audio_only=audio_only,
-            max_height=max_height,
+            max_height=download_height,
             progress_callback=update_progress,
+            session_dir=session_dir,
+            http_session=http_client.session,
         )
 
-        if not file_paths:
+    download_dir = None
+    files = None
+    # None — job перервано (зупинка бота), його продовжить resume_jobs
+    final_status = None
+    try:
+        estimate = None
+        # Файл уже в кеші або його качає інший чат — оцінка розміру не потрібна
+        if not is_in_flight(url, audio_only, max_height) and not await is_cached(
+            url, audio_only, max_height
+        ):
+            await update_progress("🔎 *Перевірка розміру...*")
+            try:
+                download_height, estimate = await probe_download(
+                    url, audio_only, max_height, LOCAL_SERVER_LIMIT
+                )
+            except FileTooLarge:
+                final_status = STATUS_FAILED
+                await progress.forget(status_msg)
+                await status_msg.edit_text(
+                    "⚠️ Файл завеликий навіть у найнижчій якості."
+                )
+                return
+            except Exception as e:
+                # Оцінка — лише оптимізація: якщо не вдалась, качаємо як є
+                logging.debug(f"Size probe failed: {e}")
+            if download_height != max_height:
+                await message.reply(
+                    f"📉 Якість знижено до {download_height}p, "
+                    f"щоб вкластися в ліміт ({LOCAL_SERVER_LIMIT // 1024 // 1024} МБ)."
+                )
+
+        if is_in_flight(url, audio_only, download_height):
+            # Хтось уже качає це посилання — просто приєднуємось, без слоту в черзі
+            files = await run_download()
+        else:
+            files = await scheduler.run(
+                user_id,
+                detect_backend(url) or "other",
+                _job_priority(url, audio_only, download_height, estimate),
+                run_download,
+                on_position=report_position,
+            )
+
+        if not files:
+            final_status = STATUS_FAILED
             # ТИХИЙ РЕЖИМ ПРИ ПОМИЛЦІ
             try:
                 await status_msg.delete()
@@ -233,67 +682,137 @@ async def process_download(
                 logging.debug(f"Failed to delete status message: {e}")
             return
 
-        download_dir = os.path.dirname(file_paths[0])
-        await status_msg.edit_text("📤 *Відправляю...*", parse_mode="Markdown")
+        download_dir = os.path.dirname(files[0].path)
+        await progress.forget(status_msg)
+        await status_msg.edit_text(
+            "📤 *Відправляю...*", parse_mode="Markdown", reply_markup=cancel_keyboard
+        )
 
-        media_group = []
-        for file_path in file_paths:
-            file_size = os.path.getsize(file_path)
-            if file_size > LOCAL_SERVER_LIMIT:
+        items = []
+        skipped = False
+        for media in files:
+            if media.size > LOCAL_SERVER_LIMIT:
                 await message.reply("⚠️ Файл завеликий.")
+                skipped = True
                 continue
-
-            ext = os.path.splitext(file_path)[1].lower()
-            file_obj = FSInputFile(file_path)
-
-            if audio_only and ext in [".mp3", ".m4a", ".flac"]:
-                await message.reply_audio(file_obj, request_timeout=7200)
-            else:
-                if ext in [".jpg", ".jpeg", ".png", ".webp"]:
-                    media_group.append(InputMediaPhoto(media=file_obj))
-                elif ext in [".mp4", ".mkv", ".mov", ".webm"]:
-                    media_group.append(InputMediaVideo(media=file_obj))
-
-        if media_group:
-            if len(media_group) == 1:
-                item = media_group[0]
-                if isinstance(item, InputMediaPhoto):
-                    await message.reply_photo(item.media, request_timeout=7200)
-                else:
-                    await message.reply_video(item.media, request_timeout=7200)
-            else:
-                for i in range(0, len(media_group), 10):
-                    await message.reply_media_group(
-                        media=media_group[i : i + 10], request_timeout=7200
-                    )
+            items.append((media.kind, FSInputFile(media.path), media))
+
+        sent_items = await _send_media(message, items)
+        final_status = STATUS_DONE
+        # Кешуємо тільки повний результат, інакше повтор віддасть неповний набір
+        if not skipped and len(sent_items) == len(items):
+            file_id_cache.put(
+                canonical_url, audio_only, max_height, sent_items, variant
+            )
 
         try:
             await status_msg.delete()
         except Exception as e:
             logging.debug(f"Error {download_dir}: {e}")
 
+    except asyncio.CancelledError:
+        if job_id not in _cancel_requested:
+            # Зупинка бота — job лишається незавершеним для resume_jobs
+            raise
+        final_status = STATUS_CANCELLED
+        await progress.forget(status_msg)
+        try:
+            await status_msg.edit_text("🚫 Скасовано.")
+        except Exception as e:
+            logging.debug(f"Failed to edit cancelled status message: {e}")
+    except FileTooLarge:
+        # Прямі завантаження (TikTok, Instagram, Threads) дізнаються розмір
+        # лише з Content-Length, уже під час завантаження
+        final_status = STATUS_FAILED
+        await progress.forget(status_msg)
+        try:
+            await status_msg.edit_text("⚠️ Файл завеликий.")
+        except Exception as e:
+            logging.debug(f"Failed to edit status message: {e}")
     except Exception as e:
+        final_status = STATUS_FAILED
         logging.error(f"Error: {e}")
         try:
             await status_msg.delete()
         except Exception as ex:
             logging.debug(f"Failed to delete status message after error: {ex}")
     finally:
-        if download_dir and os.path.exists(download_dir):
+        _active_jobs.pop(job_id, None)
+        _cancel_requested.discard(job_id)
+        await progress.forget(status_msg)
+        if final_status:
+            job_store.set_status(job_id, final_status)
+            paths = [download_dir]
+            # Скасоване завантаження могло лишитись потрібним іншим чатам —
+            # тоді папку прибере сам single-flight
+            if not handed_off or (not files and final_status != STATUS_CANCELLED):
+                paths.append(session_dir)
+            for path in paths:
+                if path and os.path.exists(path):
+                    try:
+                        shutil.rmtree(path)
+                    except Exception as e:
+                        logging.debug(
+                            f"Failed to remove download directory {path}: {e}"
+                        )
+
+
+# --- ВІДНОВЛЕННЯ ЧЕРГИ ПІСЛЯ ПЕРЕЗАПУСКУ ---
+_resumed_tasks = set()
+
+
+async def resume_jobs(bot: Bot):
+    jobs = job_store.unfinished()
+    removed = reap_session_dirs({job["session_dir"] for job in jobs})
+    job_store.prune(JOB_HISTORY_TTL)
+    if removed:
+        logging.info(f"Removed {removed} orphaned session dirs")
+
+    for job in jobs:
+        logging.info(f"Resuming job {job['id']}: {job['url']}")
+        if job["status_message_id"]:
             try:
-                shutil.rmtree(download_dir)
+                await bot.delete_message(job["chat_id"], job["status_message_id"])
             except Exception as e:
-                logging.debug(
-                    f"Failed to remove download directory {download_dir}: {e}"
-                )
+                logging.debug(f"Failed to delete stale status message: {e}")
+
+        # Повідомлення, на яке відповідатимемо, відновлюємо з chat_id / message_id
+        message = types.Message(
+            message_id=job["message_id"],
+            date=datetime.now(),
+            chat=types.Chat(id=job["chat_id"], type=job["chat_type"]),
+        ).as_(bot)
+        task = asyncio.create_task(
+            process_download(
+                message,
+                job["url"],
+                user_id=job["user_id"],
+                audio_only=bool(job["audio_only"]),
+                max_height=job["max_height"],
+                job_id=job["id"],
+                session_dir=job["session_dir"],
+            )
+        )
+        _resumed_tasks.add(task)
+        task.add_done_callback(_resumed_tasks.discard)
 
 
 async def main():
     if not API_TOKEN:
         return
     bot = Bot(token=API_TOKEN, session=session)
-    await dp.start_polling(bot)
+    progress.start()
+    await resume_jobs(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await progress.stop()
+        await http_client.close()
+        shutdown_postprocess_pool()
+        shutdown_ytdlp_pool()
+        shutdown_instagram_pool()
 
 
 if __name__ == "__main__":
+    setup()
     asyncio.run(main())
@@ -0,0 +1,202 @@
+# media_cache.py
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+from media_file import MediaFile
+
+
+# --- КЕШ ЗАВАНТАЖЕНИХ ФАЙЛІВ ---
+class MediaCache:
+    """
+    Дисковий кеш результатів download_media.
+
+    Ключ — (канонічний URL, audio_only, max_height, variant), де variant —
+    режим аудіо (native/mp3 дають різні файли). Кожен запис зберігається
+    в окремій теці, файли в сесійну папку потрапляють через hardlink, тому
+    rmtree сесії в process_download не чіпає кеш. Витіснення — LRU за
+    сумарним розміром, плюс TTL для кожного запису.
+    """
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, root: str, max_bytes: int, ttl: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._index: Dict[str, dict] = {}
+        self._load_index()
+
+    @staticmethod
+    def make_key(
+        canonical_url: str,
+        audio_only: bool,
+        max_height: Optional[int],
+        variant: str = "",
+    ) -> str:
+        raw = f"{canonical_url}|{int(bool(audio_only))}|{max_height or 0}"
+        if variant:
+            # Без variant ключі лишаються тими самими, що й до появи режимів
+            raw += f"|{variant}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # --- ІНДЕКС ---
+    def _index_path(self) -> str:
+        return os.path.join(self.root, self.INDEX_NAME)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            self._index = {}
+        except Exception as e:
+            print(f"Cache index error: {e}")
+            self._index = {}
+
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _drop(self, key: str):
+        self._index.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    # --- ОПЕРАЦІЇ ---
+    def contains(self, key: str) -> bool:
+        """Чи є живий запис з усіма файлами — без копіювання і без статистики."""
+        with self._lock:
+            entry = self._index.get(key)
+            if not entry or time.time() - entry["created"] > self.ttl:
+                return False
+            entry_dir = self._entry_dir(key)
+            return all(
+                isinstance(f, dict) and os.path.exists(os.path.join(entry_dir, f["name"]))
+                for f in entry["files"]
+            )
+
+    def fetch(self, key: str, session_dir: str) -> Optional[List[MediaFile]]:
+        """Повертає копії (hardlink) закешованих файлів у session_dir або None."""
+        with self._lock:
+            entry = self._index.get(key)
+            if not entry:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            entry_dir = self._entry_dir(key)
+            files = entry["files"]
+            if now - entry["created"] > self.ttl or not all(
+                isinstance(f, dict) for f in files
+            ):
+                # Прострочений або запис старого формату (без метаданих)
+                self.expired += 1
+                self.misses += 1
+                self._drop(key)
+                self._save_index()
+                return None
+            cached = [MediaFile.from_dict(f, entry_dir) for f in files]
+            if not all(os.path.exists(f.path) for f in cached):
+                # Теку очистили через /clean або вручну
+                self.misses += 1
+                self._drop(key)
+                self._save_index()
+                return None
+
+            os.makedirs(session_dir, exist_ok=True)
+            result = []
+            for media in cached:
+                dst = os.path.join(session_dir, media.name)
+                link_or_copy(media.path, dst)
+                result.append(media.with_path(dst))
+
+            entry["last_access"] = now
+            self.hits += 1
+            self._save_index()
+            return result
+
+    def store(self, key: str, url: str, files: List[MediaFile]):
+        """Кладе результат завантаження в кеш і витісняє старі записи."""
+        if not files:
+            return
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.makedirs(entry_dir, exist_ok=True)
+
+            for media in files:
+                link_or_copy(media.path, os.path.join(entry_dir, media.name))
+            size = sum(media.size for media in files)
+
+            if size > self.max_bytes:
+                # Один файл більший за весь кеш — немає сенсу тримати
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                return
+
+            now = time.time()
+            self._index[key] = {
+                "url": url,
+                "files": [media.to_dict() for media in files],
+                "size": size,
+                "created": now,
+                "last_access": now,
+            }
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, e in self._index.items() if now - e["created"] > self.ttl]:
+            self._drop(key)
+            self.expired += 1
+
+        total = sum(e["size"] for e in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._index[key]["size"]
+            self._drop(key)
+            self.evictions += 1
+
+    def forget_all(self):
+        """Скидає індекс (наприклад, після /clean, який видалив теку кешу)."""
+        with self._lock:
+            self._index = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "size_bytes": sum(e["size"] for e in self._index.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+def link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Інша файлова система або FS без hardlink
+        shutil.copy2(src, dst)
@@ -0,0 +1,73 @@
+# media_file.py
+import os
+from typing import Optional
+
+KIND_AUDIO = "audio"
+KIND_VIDEO = "video"
+KIND_PHOTO = "photo"
+# Лише для відправки: аудіо, яке Telegram не приймає як audio (opus/webm)
+KIND_DOCUMENT = "document"
+
+
+# --- РЕЗУЛЬТАТ ЗАВАНТАЖЕННЯ ---
+class MediaFile:
+    """
+    Один завантажений файл разом з тим, що про нього вже знає бекенд.
+
+    Тип (audio / video / photo) і метадані заповнює сам бекенд (yt-dlp
+    requested_downloads, відповідь TikWM, вузли Instaloader), тому бот
+    не вгадує їх за розширенням і не сканує папку повторно.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        kind: str,
+        size: Optional[int] = None,
+        duration: Optional[float] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        title: Optional[str] = None,
+        uploader: Optional[str] = None,
+    ):
+        self.path = path
+        self.kind = kind
+        # Розмір беремо один раз, коли файл щойно записаний
+        self.size = os.path.getsize(path) if size is None else size
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.title = title
+        self.uploader = uploader
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    def with_path(self, path: str) -> "MediaFile":
+        """Та сама копія (hardlink) в іншій папці."""
+        data = self.to_dict()
+        del data["name"]
+        return MediaFile(path, **data)
+
+    def to_dict(self) -> dict:
+        """Для індексу кешу: шлях зберігається лише як ім'я файлу."""
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "size": self.size,
+            "duration": self.duration,
+            "width": self.width,
+            "height": self.height,
+            "title": self.title,
+            "uploader": self.uploader,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, directory: str) -> "MediaFile":
+        data = dict(data)
+        path = os.path.join(directory, data.pop("name"))
+        return cls(path, **data)
+
+    def __repr__(self):
+        return f"MediaFile({self.kind}, {self.path!r}, {self.size} B)"
@@ -0,0 +1,276 @@
+# postprocess.py
+import base64
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional
+
+from mutagen.flac import Picture
+from mutagen.id3 import APIC, ID3, TDRC, TIT2, TPE1, error
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.oggopus import OggOpus
+from PIL import Image
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_postprocess_pool() -> ProcessPoolExecutor:
+    # PIL і mutagen тримають GIL — виносимо їх в окремі процеси
+    global _pool
+    if _pool is None:
+        workers = int(os.getenv("POSTPROCESS_WORKERS", "0")) or os.cpu_count() or 1
+        _pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown_postprocess_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# --- СТАТИСТИКА ---
+_timings: Dict[str, float] = {}
+_step_counts: Dict[str, int] = {}
+_jobs = 0
+
+
+def record_timings(timings: Dict[str, float]):
+    global _jobs
+    _jobs += 1
+    for step, seconds in timings.items():
+        _timings[step] = _timings.get(step, 0.0) + seconds
+        _step_counts[step] = _step_counts.get(step, 0) + 1
+
+
+def postprocess_stats() -> dict:
+    return {
+        "jobs": _jobs,
+        "steps": {
+            step: (_step_counts[step], total / _step_counts[step])
+            for step, total in _timings.items()
+        },
+    }
+
+
+# --- КЕШ ОБКЛАДИНОК ---
+def _cover_cache_dir() -> str:
+    return os.getenv("COVER_CACHE_DIR", os.path.join("downloads", "_covers"))
+
+
+def _cover_max_side() -> int:
+    return int(os.getenv("COVER_MAX_SIDE", "800"))
+
+
+def _cover_quality() -> int:
+    return int(os.getenv("COVER_JPEG_QUALITY", "90"))
+
+
+def _cover_cache_path(cover_key: str) -> str:
+    # Розмір і якість входять у ключ, щоб зміна налаштувань не віддала старе
+    raw = f"{cover_key}|{_cover_max_side()}|{_cover_quality()}"
+    name = hashlib.sha1(raw.encode("utf-8")).hexdigest() + ".jpg"
+    return os.path.join(_cover_cache_dir(), name)
+
+
+def _prune_cover_cache(max_files: int):
+    cache_dir = _cover_cache_dir()
+    try:
+        entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+        if len(entries) <= max_files:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[: len(entries) - max_files]:
+            os.remove(path)
+    except OSError:
+        # Інший воркер міг уже видалити файл
+        pass
+
+
+def _load_cached_cover(cover_key: str) -> Optional[bytes]:
+    path = _cover_cache_path(cover_key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # для LRU
+        return data
+    except OSError:
+        return None
+
+
+def _store_cover(cover_key: str, data: bytes):
+    path = _cover_cache_path(cover_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    _prune_cover_cache(int(os.getenv("COVER_CACHE_MAX_FILES", "2000")))
+
+
+# --- ОБКЛАДИНКА ---
+def _square_jpeg(thumbnail_path: str, timings: Dict[str, float]) -> bytes:
+    started = time.perf_counter()
+    with Image.open(thumbnail_path) as img:
+        # draft() дозволяє JPEG-декодеру одразу читати зменшену копію
+        max_side = _cover_max_side()
+        img.draft("RGB", (max_side, max_side))
+        width, height = img.size
+        crop_size = min(width, height)
+        left, top, right, bottom = (
+            (width - crop_size) / 2,
+            (height - crop_size) / 2,
+            (width + crop_size) / 2,
+            (height + crop_size) / 2,
+        )
+        cropped_img = img.crop((left, top, right, bottom))
+        if cropped_img.mode in ("RGBA", "LA", "P"):
+            cropped_img = cropped_img.convert("RGB")
+        if crop_size > max_side:
+            cropped_img = cropped_img.resize((max_side, max_side), Image.LANCZOS)
+        timings["crop"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        img_buffer = BytesIO()
+        cropped_img.save(img_buffer, format="JPEG", quality=_cover_quality())
+        timings["encode"] = time.perf_counter() - started
+    return img_buffer.getvalue()
+
+
+# --- ТЕГИ ДЛЯ КОЖНОГО КОНТЕЙНЕРА ---
+def _year(date_str: str) -> Optional[str]:
+    return date_str[:4] if len(date_str) >= 4 else None
+
+
+def _tag_mp3(path: str, cover: Optional[bytes], title: str, artist: str):
+    try:
+        audio = MP3(path, ID3=ID3)
+    except error:
+        audio = MP3(path)
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+
+    if cover:
+        tags.delall("APIC")
+        tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover))
+    if not tags.get("TIT2"):
+        tags.add(TIT2(encoding=3, text=title))
+    if not tags.get("TPE1"):
+        tags.add(TPE1(encoding=3, text=artist))
+    if "TDRC" in tags:
+        year = _year(str(tags["TDRC"].text[0]))
+        if year:
+            tags["TDRC"] = TDRC(encoding=3, text=year)
+    audio.save()
+
+
+def _tag_mp4(path: str, cover: Optional[bytes], title: str, artist: str):
+    audio = MP4(path)
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+
+    if cover:
+        tags["covr"] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+    if not tags.get("\xa9nam"):
+        tags["\xa9nam"] = [title]
+    if not tags.get("\xa9ART"):
+        tags["\xa9ART"] = [artist]
+    if tags.get("\xa9day"):
+        year = _year(str(tags["\xa9day"][0]))
+        if year:
+            tags["\xa9day"] = [year]
+    audio.save()
+
+
+def _tag_opus(path: str, cover: Optional[bytes], title: str, artist: str):
+    audio = OggOpus(path)
+    tags = audio.tags
+
+    if cover:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = "image/jpeg"
+        picture.desc = "Cover"
+        picture.data = cover
+        tags["metadata_block_picture"] = [
+            base64.b64encode(picture.write()).decode("ascii")
+        ]
+    if not tags.get("title"):
+        tags["title"] = [title]
+    if not tags.get("artist"):
+        tags["artist"] = [artist]
+    if tags.get("date"):
+        year = _year(tags["date"][0])
+        if year:
+            tags["date"] = [year]
+    audio.save()
+
+
+_TAGGERS = {
+    ".mp3": _tag_mp3,
+    ".m4a": _tag_mp4,
+    ".mp4": _tag_mp4,
+    ".opus": _tag_opus,
+    ".ogg": _tag_opus,
+}
+
+
+# --- ОБРОБКА АУДІО (виконується в пулі процесів) ---
+def process_audio(
+    audio_path: str,
+    thumbnail_path: Optional[str] = None,
+    title: Optional[str] = None,
+    uploader: Optional[str] = None,
+    cover_key: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Обкладинка + усі теги за одне відкриття/збереження файлу
+    (MP3 — ID3, M4A — MP4-атоми, Opus — Vorbis comments).
+    cover_key (URL мініатюри / id відео) — ключ кешу готових обкладинок.
+    Повертає час кожного кроку в секундах.
+    """
+    timings: Dict[str, float] = {}
+    total_started = time.perf_counter()
+    cover = None
+    try:
+        if cover_key:
+            started = time.perf_counter()
+            cover = _load_cached_cover(cover_key)
+            if cover:
+                timings["cover_cache"] = time.perf_counter() - started
+        if cover is None and thumbnail_path:
+            try:
+                cover = _square_jpeg(thumbnail_path, timings)
+                if cover_key:
+                    _store_cover(cover_key, cover)
+            except Exception as e:
+                print(f"Error: {e}")
+
+        tagger = _TAGGERS.get(os.path.splitext(audio_path)[1].lower())
+        if tagger:
+            started = time.perf_counter()
+            fallback_title = os.path.basename(audio_path).split(".")[0]
+            tagger(
+                audio_path,
+                cover,
+                title or fallback_title,
+                uploader or "Unknown Artist",
+            )
+            timings["tags"] = time.perf_counter() - started
+            print(f"✓ Processed metadata: {audio_path}")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if thumbnail_path and os.path.exists(thumbnail_path):
+            os.remove(thumbnail_path)
+    timings["total"] = time.perf_counter() - total_started
+    return timings
@@ -0,0 +1,139 @@
+# progress_dispatcher.py
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# (chat_id, message_id)
+MessageKey = Tuple[int, int]
+
+
+# --- ДИСПЕТЧЕР РЕДАГУВАНЬ ПРОГРЕСУ ---
+class ProgressDispatcher:
+    """
+    Усі оновлення статус-повідомлень ідуть через одну чергу.
+
+    Для кожного повідомлення зберігається лише останній текст, тож
+    проміжні стани, які не встигли відправитись, просто замінюються.
+    Редагування відправляються з глобальним бюджетом (edits_per_sec),
+    а на 429 вся черга чекає retry_after.
+
+    forget() чекає на редагування, яке вже в дорозі, тож після нього
+    фінальний текст бота ніщо не перезапише.
+    """
+
+    def __init__(self, edits_per_sec: float = 5.0):
+        self.interval = 1 / max(edits_per_sec, 0.1)
+        self._pending: Dict[MessageKey, Tuple[types.Message, str]] = {}
+        # Клавіатура (наприклад, "Скасувати"), яку кожне редагування має зберегти
+        self._markups: Dict[MessageKey, types.InlineKeyboardMarkup] = {}
+        self._last_sent: Dict[MessageKey, str] = {}
+        # Редагування, що зараз відправляється (черга шле по одному)
+        self._sending: Optional[MessageKey] = None
+        self._sending_done = asyncio.Event()
+        self._sending_stale = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        self.stats = {
+            "submitted": 0,
+            "sent": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "retry_after": 0,
+        }
+
+    @staticmethod
+    def _key(message: types.Message) -> MessageKey:
+        return (message.chat.id, message.message_id)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(
+        self,
+        message: types.Message,
+        text: str,
+        reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+    ):
+        """Ставить текст у чергу; попередній невідправлений текст замінюється."""
+        key = self._key(message)
+        if reply_markup is not None:
+            self._markups[key] = reply_markup
+        self.stats["submitted"] += 1
+        if self._last_sent.get(key) == text:
+            return
+        if key in self._pending:
+            self.stats["coalesced"] += 1
+        self._pending[key] = (message, text)
+        self.start()
+        self._wakeup.set()
+
+    async def forget(self, message: types.Message):
+        """Статус-повідомлення більше не оновлюємо (видалене / фінальний текст)."""
+        key = self._key(message)
+        if self._pending.pop(key, None) is not None:
+            self.stats["dropped"] += 1
+        if self._sending == key:
+            # Запит уже пішов: дочекаємось його, а результат не запам'ятовуємо
+            self._sending_stale = True
+            await self._sending_done.wait()
+        self._last_sent.pop(key, None)
+        self._markups.pop(key, None)
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            # Найстаріший запис — першим (dict зберігає порядок вставки)
+            key = next(iter(self._pending))
+            message, text = self._pending.pop(key)
+            self._sending = key
+            self._sending_stale = False
+            self._sending_done.clear()
+            try:
+                await message.bot.edit_message_text(
+                    text=text,
+                    chat_id=key[0],
+                    message_id=key[1],
+                    parse_mode="Markdown",
+                    reply_markup=self._markups.get(key),
+                )
+                self.stats["sent"] += 1
+                if not self._sending_stale:
+                    self._last_sent[key] = text
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                self._paused_until = time.monotonic() + e.retry_after
+                if not self._sending_stale:
+                    # Повертаємо, якщо за цей час не прийшов новіший текст
+                    self._pending.setdefault(key, (message, text))
+            except TelegramBadRequest:
+                # "message is not modified" / повідомлення вже видалене
+                pass
+            except Exception as e:
+                print(f"Progress edit error: {e}")
+            finally:
+                self._sending = None
+                self._sending_done.set()
+            await asyncio.sleep(self.interval)
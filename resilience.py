@@ -0,0 +1,204 @@
+# resilience.py
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class TransientError(Exception):
+    """Тимчасовий збій бекенда (5xx, 429, мережа) — запит варто повторити."""
+
+
+class ContentUnavailable(Exception):
+    """
+    Посилання не веде до медіа: приватний чи видалений пост, хибне
+    посилання, пост без медіа. Бекенд при цьому здоровий — це не збій.
+    """
+
+
+class BackendError(Exception):
+    """
+    Бекенд відповів, але не так, як очікувалось (блокування, зміна
+    розмітки чи API) — явний сигнал збою для запобіжника.
+    """
+
+
+class CircuitOpenError(Exception):
+    """Бекенд вимкнено запобіжником — запит відхилено без звернення до нього."""
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    # "Full jitter": повтори від різних job не б'ють у бекенд одночасно
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+# --- ЗАПОБІЖНИК (CIRCUIT BREAKER) ---
+class CircuitBreaker:
+    """
+    Запобіжник одного бекенда.
+
+    closed — запити йдуть, результати пишуться в ковзне вікно з window
+    останніх викликів; коли невдач у ньому не менше failure_rate (і викликів
+    хоча б min_calls) — open: усі запити одразу відхиляються. Через cooldown
+    секунд — half-open: пропускається один пробний запит, успіх закриває
+    запобіжник, невдача відкриває його знову.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        cooldown: float = 60.0,
+    ):
+        self.name = name
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.opened = 0
+        self.rejected = 0
+        self._outcomes: deque = deque(maxlen=max(1, window))
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._state = STATE_HALF_OPEN
+        return self._state
+
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, success: bool):
+        if self._state == STATE_HALF_OPEN:
+            self._probing = False
+            if success:
+                self._state = STATE_CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        self._outcomes.append(success)
+        if (
+            self._state == STATE_CLOSED
+            and len(self._outcomes) >= self.min_calls
+            and self.error_rate() >= self.failure_rate
+        ):
+            self._open()
+
+    def abandon(self):
+        """Проба нічого не сказала про бекенд — наступний запит стане новою пробою."""
+        self._probing = False
+
+    def _open(self):
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "error_rate": self.error_rate(),
+            "calls": len(self._outcomes),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+# --- ПОВТОРИ + ЗАПОБІЖНИКИ ДЛЯ ВСІХ БЕКЕНДІВ ---
+class Resilience:
+    """
+    Спільний шар надійності навколо бекендів.
+
+    TransientError повторюється до retries разів з експоненційною затримкою
+    і jitter. Невдачею для запобіжника вважаються лише вичерпані повтори,
+    BackendError і неочікувані винятки; ContentUnavailable (і винятки з
+    neutral) та порожній результат — нейтральні: вони кажуть про посилання,
+    а не про стан бекенда. Успіх — лише непорожній результат.
+    """
+
+    def __init__(
+        self,
+        retries: int = 2,
+        base_delay: float = 1.0,
+        max_delay: float = 10.0,
+        neutral: tuple = (),
+        **breaker_options,
+    ):
+        self.retries = max(0, retries)
+        self.neutral = (ContentUnavailable,) + tuple(neutral)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_options = breaker_options
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.retried = 0
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(name, **self.breaker_options)
+        return self.breakers[name]
+
+    async def call(
+        self,
+        name: str,
+        func: Callable[[], Awaitable],
+        on_retry: Optional[Callable[[int, float], Awaitable]] = None,
+    ):
+        breaker = self.breaker(name)
+        if not breaker.allow():
+            raise CircuitOpenError(name)
+        recorded = False
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    result = await func()
+                except TransientError as e:
+                    if attempt >= self.retries:
+                        raise
+                    delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                    self.retried += 1
+                    print(f"{name}: transient error ({e}), retry in {delay:.1f}s")
+                    if on_retry:
+                        await on_retry(attempt + 1, delay)
+                    await asyncio.sleep(delay)
+                    continue
+                if result:
+                    breaker.record(True)
+                    recorded = True
+                return result
+        except Exception as e:
+            if not isinstance(e, self.neutral):
+                breaker.record(False)
+                recorded = True
+            raise
+        finally:
+            if not recorded:
+                # Скасування, порожній результат, недоступний контент — не збій
+                # бекенда; пробу half-open віддаємо наступному запиту
+                breaker.abandon()
+
+    def stats(self) -> dict:
+        return {
+            "retried": self.retried,
+            "backends": {name: b.stats() for name, b in self.breakers.items()},
+        }
@@ -0,0 +1,147 @@
+# scheduler.py
+import asyncio
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Пріоритети: менше — раніше
+PRIORITY_SMALL = 0  # фото, shorts, TikTok, аудіо
+PRIORITY_NORMAL = 1  # відео до 720p
+PRIORITY_LARGE = 2  # 1080p+ / найкраща якість
+
+# Через скільки секунд очікування job піднімається на один рівень пріоритету
+AGING_SECONDS = 120
+
+
+class _Job:
+    def __init__(
+        self,
+        user_id: int,
+        backend: str,
+        priority: int,
+        seq: int,
+        on_position: Optional[Callable[[int], Awaitable]],
+    ):
+        self.user_id = user_id
+        self.backend = backend
+        self.priority = priority
+        self.seq = seq
+        self.on_position = on_position
+        self.enqueued_at = time.monotonic()
+        self.started = asyncio.Event()
+        self.last_position: Optional[int] = None
+
+
+# --- ПЛАНУВАЛЬНИК ЗАВАНТАЖЕНЬ ---
+class JobScheduler:
+    """
+    Черга завантажень з глобальним лімітом і лімітами на кожен бекенд.
+
+    Порядок: спершу користувачі з меншою кількістю активних job (чесна
+    черга), далі пріоритет (дрібні файли раніше за 1080p+), далі FIFO.
+    """
+
+    def __init__(self, global_limit: int, backend_limits: Dict[str, int]):
+        self.global_limit = max(1, global_limit)
+        self.backend_limits = backend_limits
+        self._pending: List[_Job] = []
+        self._running_total = 0
+        self._running_backend: Dict[str, int] = {}
+        self._running_user: Dict[int, int] = {}
+        self._seq = itertools.count()
+        # Сильні посилання на on_position, щоб GC не зібрав задачу посеред роботи
+        self._position_tasks: set = set()
+        self.completed = 0
+
+    def _sort_key(self, job: _Job, now: float):
+        aged = job.priority - int((now - job.enqueued_at) // AGING_SECONDS)
+        return (self._running_user.get(job.user_id, 0), max(aged, 0), job.seq)
+
+    def _backend_free(self, backend: str) -> bool:
+        limit = self.backend_limits.get(backend)
+        return limit is None or self._running_backend.get(backend, 0) < limit
+
+    def _dispatch(self):
+        while self._pending and self._running_total < self.global_limit:
+            now = time.monotonic()
+            candidates = sorted(self._pending, key=lambda j: self._sort_key(j, now))
+            job = next((j for j in candidates if self._backend_free(j.backend)), None)
+            if job is None:
+                break
+            self._pending.remove(job)
+            self._running_total += 1
+            self._running_backend[job.backend] = (
+                self._running_backend.get(job.backend, 0) + 1
+            )
+            self._running_user[job.user_id] = self._running_user.get(job.user_id, 0) + 1
+            job.started.set()
+        self._report_positions()
+
+    def _report_positions(self):
+        now = time.monotonic()
+        ordered = sorted(self._pending, key=lambda j: self._sort_key(j, now))
+        for position, job in enumerate(ordered, start=1):
+            if job.on_position and job.last_position != position:
+                job.last_position = position
+                task = asyncio.ensure_future(job.on_position(position))
+                self._position_tasks.add(task)
+                task.add_done_callback(self._position_tasks.discard)
+
+    def _release(self, job: _Job):
+        self._running_total -= 1
+        self._running_backend[job.backend] -= 1
+        self._running_user[job.user_id] -= 1
+        if not self._running_user[job.user_id]:
+            del self._running_user[job.user_id]
+        self.completed += 1
+        self._dispatch()
+
+    async def run(
+        self,
+        user_id: int,
+        backend: str,
+        priority: int,
+        factory: Callable[[], Awaitable],
+        on_position: Optional[Callable[[int], Awaitable]] = None,
+    ):
+        """Чекає на вільний слот і виконує factory()."""
+        job = _Job(user_id, backend, priority, next(self._seq), on_position)
+        self._pending.append(job)
+        self._dispatch()
+        try:
+            await job.started.wait()
+        except BaseException:
+            if job in self._pending:
+                self._pending.remove(job)
+                self._report_positions()
+            else:
+                self._release(job)
+            raise
+        try:
+            return await factory()
+        finally:
+            self._release(job)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running_total,
+            "pending": len(self._pending),
+            "completed": self.completed,
+            "global_limit": self.global_limit,
+            "backends": {
+                name: (self._running_backend.get(name, 0), limit)
+                for name, limit in self.backend_limits.items()
+            },
+        }
+
+
+def parse_backend_limits(spec: str) -> Dict[str, int]:
+    """'youtube=2,instagram=1' -> {'youtube': 2, 'instagram': 1}"""
+    limits = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        if name.strip() and value.strip().isdigit():
+            limits[name.strip().lower()] = max(1, int(value))
+    return limits
@@ -0,0 +1,296 @@
+# tests/test_http_fetch.py
+"""
+fetch_ranged проти локального aiohttp-сервера з підтримкою Range.
+
+Запуск з кореня репозиторію:
+    python -m pytest -q tests
+"""
+import asyncio
+import json
+import os
+import sys
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_fetch import (  # noqa: E402
+    fetch_many,
+    fetch_ranged,
+    fetch_to_file,
+    fetch_with_retries,
+)
+
+DATA = bytes(range(256)) * 1024  # 256 KB
+SEGMENTS = 4
+
+
+def _parse_range(header: str):
+    start, _, end = header.replace("bytes=", "").partition("-")
+    return int(start), int(end) if end else len(DATA) - 1
+
+
+def make_app(broken_start=None):
+    """
+    Сервер віддає DATA з Range. Сегмент, що починається з broken_start,
+    завжди падає, а решта сегментів віддає сміття повільно — вони ще
+    качаються, коли fetch_ranged переходить на один потік.
+    """
+
+    async def handler(request: web.Request):
+        header = request.headers.get("Range")
+        if not header:
+            return web.Response(body=DATA)
+        start, end = _parse_range(header)
+        content_range = f"bytes {start}-{end}/{len(DATA)}"
+        if broken_start is None or end == start:
+            return web.Response(
+                status=206,
+                body=DATA[start : end + 1],
+                headers={"Content-Range": content_range},
+            )
+        if start == broken_start:
+            return web.Response(status=200, body=b"no ranges today")
+
+        resp = web.StreamResponse(status=206, headers={"Content-Range": content_range})
+        resp.content_length = end - start + 1
+        await resp.prepare(request)
+        for offset in range(start, end + 1, 1024):
+            await resp.write(b"\0" * min(1024, end + 1 - offset))
+            await asyncio.sleep(0.05)
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    return app
+
+
+def _pending_segments() -> list:
+    return [
+        t
+        for t in asyncio.all_tasks()
+        if not t.done() and t.get_coro().__name__ == "_fetch_segment"
+    ]
+
+
+async def _run(tmp_path, app, settle: float = 0.0) -> bytes:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    path = str(tmp_path / "video.mp4")
+    try:
+        async with aiohttp.ClientSession() as session:
+            written = await fetch_ranged(
+                session, f"http://127.0.0.1:{port}/file", path, segments=SEGMENTS
+            )
+            assert written == len(DATA)
+            assert _pending_segments() == []
+            # Час, за який завислі сегменти встигли б зіпсувати файл
+            await asyncio.sleep(settle)
+    finally:
+        await runner.cleanup()
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_ranged_download(tmp_path, monkeypatch):
+    monkeypatch.setenv("FETCH_RANGED_MIN_MB", "0")
+    assert asyncio.run(_run(tmp_path, make_app())) == DATA
+    assert not os.path.exists(tmp_path / "video.mp4.part")
+    assert not os.path.exists(tmp_path / "video.mp4.ranged")
+
+
+def test_failed_segment_stops_siblings_before_fallback(tmp_path, monkeypatch):
+    monkeypatch.setenv("FETCH_RANGED_MIN_MB", "0")
+    app = make_app(broken_start=0)
+    assert asyncio.run(_run(tmp_path, app, settle=2.0)) == DATA
+
+
+def make_trickle_app(pause: float, chunks: int = 10):
+    """Віддає DATA шматками з паузою pause між ними, без Range."""
+
+    async def handler(request: web.Request):
+        resp = web.StreamResponse()
+        resp.content_length = len(DATA)
+        await resp.prepare(request)
+        step = -(-len(DATA) // chunks)
+        for offset in range(0, len(DATA), step):
+            await resp.write(DATA[offset : offset + step])
+            await asyncio.sleep(pause)
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    return app
+
+
+async def _run_many(tmp_path, app, timeout: float):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    path = str(tmp_path / "slide.jpg")
+    try:
+        async with aiohttp.ClientSession() as session:
+            return await fetch_many(
+                session,
+                [(f"http://127.0.0.1:{port}/file", path)],
+                timeout=timeout,
+                retries=0,
+            )
+    finally:
+        await runner.cleanup()
+
+
+def test_slow_transfer_is_not_cut_by_idle_timeout(tmp_path):
+    # Загалом ~1 с, але між шматками лише 0.1 с — тайм-аут тиші 0.5 с
+    paths = asyncio.run(_run_many(tmp_path, make_trickle_app(0.1), timeout=0.5))
+    assert paths == [str(tmp_path / "slide.jpg")]
+    with open(paths[0], "rb") as f:
+        assert f.read() == DATA
+
+
+def test_stalled_transfer_hits_idle_timeout(tmp_path):
+    paths = asyncio.run(
+        _run_many(tmp_path, make_trickle_app(1.0, chunks=2), timeout=0.3)
+    )
+    assert paths == [None]
+
+
+# --- ДОКАЧУВАННЯ ---
+ETAG = '"v1"'
+
+
+async def _serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/file"
+
+
+def make_resumable_app(requests: list, drop_after=None, etag=ETAG):
+    """
+    Сервер з ETag і If-Range. drop_after — після скількох байтів перший
+    запит обриває з'єднання посеред тіла.
+    """
+
+    async def handler(request: web.Request):
+        header = request.headers.get("Range")
+        requests.append((header, request.headers.get("If-Range")))
+        start = 0
+        if header and request.headers.get("If-Range", etag) == etag:
+            start, _ = _parse_range(header)
+        resp = web.StreamResponse(status=206 if start else 200)
+        resp.headers["ETag"] = etag
+        if start:
+            resp.headers["Content-Range"] = f"bytes {start}-{len(DATA) - 1}/{len(DATA)}"
+        resp.content_length = len(DATA) - start
+        await resp.prepare(request)
+        if drop_after is not None and len(requests) == 1:
+            await resp.write(DATA[:drop_after])
+            request.transport.close()
+            return resp
+        await resp.write(DATA[start:])
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    return app
+
+
+def test_dropped_connection_resumes_from_part(tmp_path):
+    requests = []
+    path = str(tmp_path / "video.mp4")
+    half = len(DATA) // 2
+
+    async def main():
+        runner, url = await _serve(make_resumable_app(requests, drop_after=half))
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await fetch_with_retries(session, url, path, retries=1)
+        finally:
+            await runner.cleanup()
+
+    assert asyncio.run(main()) == len(DATA)
+    assert requests == [(None, None), (f"bytes={half}-", ETAG)]
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+
+
+def test_changed_validator_restarts_download(tmp_path):
+    requests = []
+    path = str(tmp_path / "video.mp4")
+    # Недокачаний .part від старої версії файлу
+    with open(path + ".part", "wb") as f:
+        f.write(b"x" * 1000)
+    with open(path + ".part.json", "w", encoding="utf-8") as f:
+        json.dump({"url": "old", "validator": '"v0"', "bytes": 1000}, f)
+
+    async def main():
+        runner, url = await _serve(make_resumable_app(requests))
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await fetch_to_file(session, url, path)
+        finally:
+            await runner.cleanup()
+
+    assert asyncio.run(main()) == len(DATA)
+    assert requests == [("bytes=1000-", '"v0"')]
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+
+
+def test_ranged_download_resumes_missing_segments(tmp_path, monkeypatch):
+    monkeypatch.setenv("FETCH_RANGED_MIN_MB", "0")
+    monkeypatch.setenv("FETCH_SEGMENTS", str(SEGMENTS))
+    segment = len(DATA) // SEGMENTS
+    requests = []
+
+    async def handler(request: web.Request):
+        start, end = _parse_range(request.headers["Range"])
+        requests.append((start, end))
+        # Останній сегмент віддає 503, поки не вичерпає повтори першої спроби
+        if start == 3 * segment and requests.count((start, end)) <= 3:
+            return web.Response(status=503)
+        return web.Response(
+            status=206,
+            body=DATA[start : end + 1],
+            headers={
+                "Content-Range": f"bytes {start}-{end}/{len(DATA)}",
+                "ETag": ETAG,
+            },
+        )
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    path = str(tmp_path / "video.mp4")
+
+    async def main():
+        runner, url = await _serve(app)
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await fetch_with_retries(
+                    session, url, path, retries=1, ranged=True
+                )
+        finally:
+            await runner.cleanup()
+
+    assert asyncio.run(main()) == len(DATA)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    # Друга спроба: проба розміру і лише сегмент, якого бракувало
+    probe = (0, 0)
+    second = requests[requests.index(probe, 1) :]
+    assert second == [probe, (3 * segment, len(DATA) - 1)]
+    assert not os.path.exists(path + ".ranged")
+    assert not os.path.exists(path + ".ranged.json")
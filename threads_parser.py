@@ -0,0 +1,100 @@
+# threads_parser.py
+import json
+from typing import Iterator, List, Optional
+
+_SCRIPT_OPEN = "<script"
+_SCRIPT_CLOSE = "</script>"
+
+
+def _candidate_scripts(html: str, shortcode: str) -> Iterator[str]:
+    """
+    Тіла <script data-sjs>, в яких зустрічається shortcode.
+
+    Замість regex по всіх скриптах сторінки шукаємо сам shortcode і
+    розширюємося до тегу навколо нього — решту скриптів навіть не читаємо.
+    """
+    pos = html.find(shortcode)
+    while pos != -1:
+        start = html.rfind(_SCRIPT_OPEN, 0, pos)
+        tag_end = html.find(">", start) if start != -1 else -1
+        end = html.find(_SCRIPT_CLOSE, pos)
+        if (
+            start != -1
+            and end != -1
+            and tag_end < pos
+            # Між відкриттям і shortcode не має бути закриття іншого скрипта
+            and html.rfind(_SCRIPT_CLOSE, start, pos) == -1
+            and "data-sjs" in html[start:tag_end]
+        ):
+            yield html[tag_end + 1 : end]
+            pos = html.find(shortcode, end)
+        else:
+            pos = html.find(shortcode, pos + 1)
+
+
+def find_node_with_code(data, code: str) -> Optional[dict]:
+    """Перший (в порядку обходу в глибину) dict з "code" == code, без рекурсії."""
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if item.get("code") == code:
+                return item
+            children = item.values()
+        elif isinstance(item, list):
+            children = item
+        else:
+            continue
+        # У зворотному порядку, щоб обхід збігався з рекурсивним
+        stack.extend(
+            child for child in reversed(list(children)) if isinstance(child, (dict, list))
+        )
+    return None
+
+
+def find_post_node(html: str, shortcode: str) -> Optional[dict]:
+    """Вузол поста з потрібним shortcode у data-sjs JSON сторінки Threads."""
+    for script in _candidate_scripts(html, shortcode):
+        try:
+            data = json.loads(script)
+        except (ValueError, RecursionError):
+            # Биті дані або вкладеність, глибша за ліміт самого декодера json
+            continue
+        node = find_node_with_code(data, shortcode)
+        if node:
+            return node
+    return None
+
+
+def _best_url(node: dict, key: str) -> Optional[str]:
+    if key == "video_versions" and node.get(key):
+        return node[key][0]["url"]
+    if key == "image_versions2" and node.get(key):
+        cands = node[key].get("candidates", [])
+        if cands:
+            # Sort by width DESC
+            return max(cands, key=lambda x: x.get("width", 0))["url"]
+    return None
+
+
+def extract_media_urls(node: dict) -> List[str]:
+    """URL медіа поста в порядку каруселі (відео має пріоритет над прев'ю)."""
+    media_urls = {}
+
+    # 1. Carousel
+    for item in node.get("carousel_media") or []:
+        url = _best_url(item, "video_versions") or _best_url(item, "image_versions2")
+        if url:
+            media_urls[url] = None
+
+    # 2. Single Video
+    v_url = _best_url(node, "video_versions")
+    if v_url:
+        media_urls[v_url] = None
+    elif not node.get("carousel_media"):
+        # 3. Single Image
+        i_url = _best_url(node, "image_versions2")
+        if i_url:
+            media_urls[i_url] = None
+
+    return list(media_urls)
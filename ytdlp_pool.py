@@ -0,0 +1,217 @@
+# ytdlp_pool.py
+import asyncio
+import multiprocessing
+import os
+import pickle
+import signal
+import sys
+import traceback
+from typing import Awaitable, Callable, List, Optional
+
+
+# --- ПРОЦЕС-ВОРКЕР ---
+def _worker_main(conn):
+    """
+    Цикл воркера: отримує (func, args, kwargs), викликає func(..., notify=...)
+    і відсилає назад ("progress", текст) / ("result", значення) /
+    ("error", (traceback, сам виняток або None, якщо він не серіалізується)).
+    """
+    if hasattr(os, "setsid"):
+        # Своя група процесів: kill зачепить і дочірні ffmpeg
+        os.setsid()
+
+    def notify(text: str):
+        conn.send(("progress", text))
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        func, args, kwargs = task
+        try:
+            conn.send(("result", func(*args, notify=notify, **kwargs)))
+        except Exception as e:
+            text = traceback.format_exc()
+            sys.stderr.write(text)
+            try:
+                # Тип винятку потрібен батьку (ContentUnavailable, FileTooLarge...)
+                pickle.dumps(e)
+            except Exception:
+                e = None
+            conn.send(("error", (text, e)))
+
+
+class WorkerError(Exception):
+    """
+    Виняток із задачі у воркері; fatal — сам воркер помер.
+    original — виняток задачі, message — його traceback з воркера.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        fatal: bool = False,
+        original: Optional[BaseException] = None,
+    ):
+        super().__init__(message)
+        self.fatal = fatal
+        self.original = original
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        # Задачі прогресу живуть, поки не відпрацюють (loop тримає їх слабко)
+        self._progress_tasks: set = set()
+
+    async def call(
+        self,
+        func: Callable,
+        args: tuple,
+        kwargs: dict,
+        on_progress: Optional[Callable[[str], Awaitable]],
+    ):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = self.conn.fileno()
+
+        def on_readable():
+            try:
+                while self.conn.poll():
+                    kind, payload = self.conn.recv()
+                    if kind == "progress":
+                        if on_progress:
+                            task = asyncio.ensure_future(on_progress(payload))
+                            self._progress_tasks.add(task)
+                            task.add_done_callback(self._progress_tasks.discard)
+                    elif not future.done():
+                        if kind == "result":
+                            future.set_result(payload)
+                        else:
+                            text, original = payload
+                            future.set_exception(WorkerError(text, original=original))
+            except (EOFError, OSError):
+                loop.remove_reader(fd)
+                if not future.done():
+                    future.set_exception(WorkerError("yt-dlp worker died", fatal=True))
+
+        # Подія "є дані в пайпі" приходить прямо в event loop, без потоків
+        loop.add_reader(fd, on_readable)
+        try:
+            self.conn.send((func, args, kwargs))
+            return await future
+        finally:
+            loop.remove_reader(fd)
+
+    def kill(self):
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.conn.close()
+
+    def retire(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+# --- ПУЛ ПРОЦЕСІВ YT-DLP ---
+class YtdlpProcessPool:
+    """
+    Пул процесів для синхронних завантажень yt-dlp.
+
+    Кожна задача виконується в окремому процесі (без боротьби за GIL
+    з ботом), прогрес приходить через пайп. Задача, що не вклалась
+    у timeout або була скасована, вбиває свій воркер разом з ffmpeg;
+    після max_jobs задач воркер замінюється новим, щоб не ріс по пам'яті.
+    """
+
+    def __init__(self, size: int, max_jobs: int, timeout: float):
+        self.size = max(1, size)
+        self.max_jobs = max(1, max_jobs)
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self._busy: List[_Worker] = []
+        self._retired: List[_Worker] = []
+        self._slots = asyncio.Semaphore(self.size)
+        self.stats = {"jobs": 0, "failed": 0, "timeouts": 0, "killed": 0, "recycled": 0}
+
+    def _reap(self):
+        # is_alive() забирає код завершення, щоб не лишалось зомбі
+        self._retired = [w for w in self._retired if w.process.is_alive()]
+
+    async def run(
+        self,
+        func: Callable,
+        *args,
+        on_progress: Optional[Callable[[str], Awaitable]] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ):
+        """Виконує func(*args, notify=..., **kwargs) у воркері й повертає результат."""
+        async with self._slots:
+            self._reap()
+            worker = self._idle.pop() if self._idle else _Worker(self._ctx)
+            self._busy.append(worker)
+            try:
+                result = await asyncio.wait_for(
+                    worker.call(func, args, kwargs, on_progress),
+                    timeout or self.timeout,
+                )
+            except WorkerError as e:
+                self.stats["failed"] += 1
+                self._release(worker, healthy=not e.fatal)
+                if e.original is not None:
+                    # Той самий тип, що й у потоковому режимі; traceback воркера — у __cause__
+                    raise e.original from e
+                raise
+            except BaseException as e:
+                # Таймаут або скасування — процес вбиваємо разом з ffmpeg
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["timeouts"] += 1
+                self.stats["killed"] += 1
+                self.stats["failed"] += 1
+                self._release(worker, healthy=False)
+                raise
+            self.stats["jobs"] += 1
+            self._release(worker, healthy=True)
+            return result
+
+    def _release(self, worker: _Worker, healthy: bool):
+        self._busy.remove(worker)
+        if not healthy:
+            worker.kill()
+            self._retired.append(worker)
+            return
+        worker.jobs += 1
+        if worker.jobs >= self.max_jobs:
+            self.stats["recycled"] += 1
+            worker.retire()
+            self._retired.append(worker)
+        else:
+            self._idle.append(worker)
+
+    def workers(self) -> int:
+        return len(self._idle) + len(self._busy)
+
+    def shutdown(self):
+        for worker in self._idle:
+            worker.retire()
+        for worker in self._busy:
+            worker.kill()
+        self._retired += self._idle + self._busy
+        self._idle, self._busy = [], []